@@ -2,13 +2,21 @@
 import ui_html
 import time
 import socket
+import select
+import errno
 import ujson
+import ustruct
+from array import array
 import network
 import wifi_prov
 import neopixel
 from machine import Pin, I2C
 from pn532 import PN532_I2C
 import encrypt
+import metrics
+import tracing
+import logsink
+from tracing import trace
 
 # -----------------------
 # SETTINGS
@@ -40,6 +48,11 @@ TG_DEVICE_NAME = encrypt.get_env_value(ENV_FILE, "TG_DEVICE_NAME")
 TG_POLL_EVERY_MS = int(encrypt.get_env_value(ENV_FILE, "TG_POLL_EVERY_MS"))
 TG_NOTIFY_ON_TAP = bool(encrypt.get_env_value(ENV_FILE, "TG_NOTIFY_ON_TAP"))
 
+# Bot API endpoint (override to use tools/tg_stub_server.py offline)
+TG_API_HOST = encrypt.get_env_value(ENV_FILE, "TG_API_HOST") or "api.telegram.org"
+TG_API_TLS = (encrypt.get_env_value(ENV_FILE, "TG_API_TLS") or "1").lower() not in ("0", "false", "no", "off")
+TG_API_PORT = int(encrypt.get_env_value(ENV_FILE, "TG_API_PORT") or (443 if TG_API_TLS else 80))
+
 ADMIN_TOKEN = encrypt.get_env_value(ENV_FILE, "ADMIN_TOKEN") or ""
 
 # UI Basic Auth
@@ -58,15 +71,66 @@ HOLD_CLEAR_MS = 10000
 
 NFC_POLL_TIMEOUT_MS = 80
 NFC_LOOP_SLEEP_MS = 25
+NFC_PRESENCE_MISSES = 2   # failed presence checks in a row before "card removed"
+
+# App web server (non-blocking, select.poll)
+HTTP_MAX_HEADER = 2048       # request line + headers
+HTTP_MAX_BODY = 4096         # Content-Length limit
+HTTP_BODY_LIMITS = {         # per-path overrides of HTTP_MAX_BODY
+    "/api/uids/batch": 16384,
+}
+HTTP_STREAM_BODY = {         # bodies fed to the handler's sink as they arrive -> size limit
+    "/api/uids/import": 1048576,
+}
+HTTP_REQ_TIMEOUT_MS = 3000   # whole request must arrive within this
+HTTP_STREAM_TIMEOUT_MS = 60000  # whole streamed body (HTTP_STREAM_BODY) must arrive within this
+HTTP_SEND_TIMEOUT_MS = 3000  # client must accept some output within this, or it is dropped
+HTTP_OUT_MAX = 8192          # queued (unsent) response bytes per connection
+HTTP_BACKLOG = 8             # listen() backlog
+HTTP_MAX_CONNS = 8           # open client sockets (incl. SSE); extra ones wait in the backlog
+HTTP_ACCEPT_BUDGET_MS = 15   # max time per loop iteration spent accepting
+HTTP_KEEPALIVE_IDLE_MS = 5000  # idle kept-alive socket is closed after this
+HTTP_KEEPALIVE_MAX_REQ = 100   # requests per connection, then Connection: close
+HTTP_KEEPALIVE_MAX = 4         # kept-alive sockets at once (of HTTP_MAX_CONNS)
+
+# Admission control: HTTP must not slow down card reads
+HTTP_LOOP_BUDGET_MS = 30     # HTTP work per main-loop iteration; the rest waits for the next one
+HTTP_RATE_PER_S = 10         # requests per second per client IP (token bucket; 0 = off)
+HTTP_RATE_BURST = 20         # bucket size
+HTTP_RATE_CLIENTS = 16       # IPs tracked; the least recently seen is forgotten
+HTTP_SHED_AFTER_MS = 1000    # backlog waiting this long with all sockets busy -> 503
 
 LOG_BTN = True
 LOG_PORTAL = True
 
+# Logging (logsink.py): lines are buffered and printed from the main loop
+LOG_LEVEL = logsink.INFO      # DEBUG / INFO / WARN / ERROR
+LOG_FILE = ""                 # e.g. "log.txt" for a rotating flash log ("" = off)
+LOG_FILE_MAX = 16384          # bytes per flash log file (one older copy kept)
+LOG_DRAIN_LINES = 4           # console lines printed per loop iteration
+
 UIDS_FILE = "uids.json"
+UIDS_IMPORT_FILE = "uids.imp"  # import staging: parsed cards, one jsonl line each
 DEFAULT_UIDS_HEX = []
 
 ALLOWED_UIDS = set()
 ALLOWED_UIDS_HEX = set()
+UIDS_SORTED = []       # sorted hex UIDs: list order, pagination cursor
+DB_VERSION = 0         # bumped on every card DB change
+
+# Card usage, parallel to UIDS_SORTED (see CARD USAGE STATS)
+CARD_TAPS = array("I")     # granted taps
+CARD_LAST = array("I")     # device time (s) of the last tap, 0 = never
+DENIED_UNKNOWN = {}        # unknown UID hex -> [attempts, last time], bounded LRU
+DENIED_UNKNOWN_MAX = 32
+CARD_STATS_FILE = "card_stats.txt"
+CARD_STATS_FLUSH_MS = 300000   # written on this timer (if changed), never per tap
+
+UIDS_PAGE_DEFAULT = 50
+UIDS_PAGE_MAX = 100
+UIDS_BATCH_MAX = 500   # operations per /api/uids/batch request
+UIDS_LINE_MAX = 256    # longest card line accepted by the streaming reader
+SSE_DELTA_MAX = 20     # queued card changes per SSE "cards" event; more -> client reloads
 
 # ✅ NEW: Names storage
 UID_NAME_BY_HEX = {}   # "15 D6 14 06" -> "John"
@@ -78,6 +142,43 @@ LAST_FW = ""
 LAST_NAME = ""
 EVENT_ID = 0
 
+CARD_PRESENT_HEX = ""   # card currently on the reader ("" = none)
+
+LED = None          # NeoPixel (set in run())
+SSE_CLIENT = None   # single live /events socket
+
+# Tap latency per stage (microseconds), see _tap_lap() in run()
+TAP_STAGES = ("i2c_read", "uid_hex", "db_lookup", "led", "tg", "sse", "total")
+TAP_LAT = {}
+for _st in TAP_STAGES:
+    TAP_LAT[_st] = metrics.Histogram()
+
+# Tap filter: per-card debounce, rate limit and lockout (see _tap_admit)
+TAP_DEBOUNCE_MS = 1200         # card seen again within this -> ignored (also while it lies on the reader)
+TAP_RATE_MAX = 6               # accepted taps per card...
+TAP_RATE_WINDOW_MS = 60000     # ...per this window
+TAP_DENY_LOCKOUT_AFTER = 5     # denied taps in a row -> card ignored for...
+TAP_DENY_LOCKOUT_MS = 60000
+TAP_TABLE_SIZE = 16            # cards tracked; the least recently seen is forgotten
+
+# Access log on flash: fixed-size records in a circular file
+ACCESS_LOG_FILE = "access.bin"
+ACCESS_LOG_MAX = 2000        # records kept (oldest overwritten), 24 B each
+ACCESS_LOG_BATCH = 8         # taps buffered per flash write...
+ACCESS_LOG_FLUSH_MS = 5000   # ...or at most this long
+ACCESS_LOG_QUERY_MAX = 500   # records per /api/events request
+READER_ID = 1
+
+# Span tracing (tracing.py): off by default, toggled via POST /api/trace
+TRACE_ENABLED = False
+
+# Main loop supervisor, see _loop_stage() / _loop_supervise()
+LOOP_STALL_MS = 250     # iteration longer than this is recorded as a stall
+LOOP_STALL_TOP = 8      # worst stalls kept for /api/stalls
+# Hardware watchdog: loop stuck this long -> reset. Off by default (0): the ESP32 WDT
+# cannot be stopped once started, see _wdt_hold()
+LOOP_WDT_MS = int(encrypt.get_env_value(ENV_FILE, "LOOP_WDT_MS") or 0)
+
 
 # -----------------------
 # TIME / LOG
@@ -95,17 +196,30 @@ def op_ms(t0):
 
 
 def log(*args):
-    try:
-        print(*args)
-    except:
-        pass
+    logsink.emit(logsink.INFO, args)
+
+
+def log_debug(*args):
+    logsink.emit(logsink.DEBUG, args)
+
+
+def log_warn(*args):
+    logsink.emit(logsink.WARN, args)
+
+
+def log_err(*args):
+    logsink.emit(logsink.ERROR, args)
 
 
 def op_log(name, ms, extra=""):
-    try:
-        print("[OP]", name, ms, extra)
-    except:
-        pass
+    logsink.emit(logsink.INFO, ("[OP]", name, ms, extra))
+
+
+def _tap_lap(stage, t0_us):
+    """Record the stage that started at t0_us; returns now (start of the next stage)."""
+    t = time.ticks_us()
+    TAP_LAT[stage].add(time.ticks_diff(t, t0_us))
+    return t
 
 
 # -----------------------
@@ -230,32 +344,260 @@ def uid_hex_to_bytes(uid_hex: str):
 
 
 def _sync_hex_set_from_bytes():
-    global ALLOWED_UIDS_HEX
+    global ALLOWED_UIDS_HEX, UIDS_SORTED
+    used = _card_stats_used()
     ALLOWED_UIDS_HEX = set([uid_bytes_to_hex(u) for u in ALLOWED_UIDS])
+    UIDS_SORTED = sorted(ALLOWED_UIDS_HEX)
+    _card_stats_rebuild(used)
 
 
-def uids_list_cards():
-    _sync_hex_set_from_bytes()
+def _bisect_left(a, x):
+    lo, hi = 0, len(a)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if a[mid] < x:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def _bisect_right(a, x):
+    lo, hi = 0, len(a)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if x < a[mid]:
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
+def _boot_epoch():
+    # DB_VERSION restarts at 0 on every boot; ETags also carry this
+    try:
+        import urandom
+        return urandom.getrandbits(24)
+    except:
+        return now_ms() & 0xFFFFFF
+
+
+_DB_EPOCH = _boot_epoch()
+
+# Card changes not yet pushed to the SSE client (see _sse_flush_deltas)
+_DB_DELTAS = []        # [{"op": "add"|"remove"|"rename", "uid": hx, "name": ..}]
+_DB_DELTA_BASE = 0     # DB_VERSION the queued deltas apply on top of
+_DB_DELTA_RESET = False
+
+
+def _db_touch(op=None, hx=None):
+    """Bump DB_VERSION and queue the change for SSE (op=None: bulk change, clients reload)."""
+    global DB_VERSION, _DB_DELTA_BASE, _DB_DELTA_RESET
+    if not _DB_DELTAS and not _DB_DELTA_RESET:
+        _DB_DELTA_BASE = DB_VERSION
+    DB_VERSION += 1
+
+    if op is None or len(_DB_DELTAS) >= SSE_DELTA_MAX:
+        _DB_DELTA_RESET = True
+        del _DB_DELTAS[:]
+    elif not _DB_DELTA_RESET:
+        d = {"op": op, "uid": hx}
+        if op != "remove":
+            d["name"] = UID_NAME_BY_HEX.get(hx, "")
+        _DB_DELTAS.append(d)
+
+
+# Set by uids_batch: CARD_TAPS/CARD_LAST are left alone per card and rebuilt once
+_index_bulk = False
+
+
+def _index_add(b, hx):
+    global CARD_TAPS, CARD_LAST
+    ALLOWED_UIDS.add(b)
+    ALLOWED_UIDS_HEX.add(hx)
+    i = _bisect_left(UIDS_SORTED, hx)
+    UIDS_SORTED.insert(i, hx)
+    if _index_bulk:
+        return
+    # array has no insert(); single edits are rare, the tap path never resizes
+    CARD_TAPS = CARD_TAPS[:i] + array("I", [0]) + CARD_TAPS[i:]
+    CARD_LAST = CARD_LAST[:i] + array("I", [0]) + CARD_LAST[i:]
+
+
+def _index_remove(b, hx):
+    global CARD_TAPS, CARD_LAST
+    ALLOWED_UIDS.discard(b)
+    ALLOWED_UIDS_HEX.discard(hx)
+    i = _bisect_left(UIDS_SORTED, hx)
+    if i < len(UIDS_SORTED) and UIDS_SORTED[i] == hx:
+        UIDS_SORTED.pop(i)
+        if _index_bulk:
+            return
+        CARD_TAPS = CARD_TAPS[:i] + CARD_TAPS[i + 1:]
+        CARD_LAST = CARD_LAST[:i] + CARD_LAST[i + 1:]
+
+
+def _card_index(hx):
+    i = _bisect_left(UIDS_SORTED, hx)
+    return i if (i < len(UIDS_SORTED) and UIDS_SORTED[i] == hx) else -1
+
+
+def _search_key(q):
+    # "15:d6 14" -> "15D614" (UID prefix), plus lower-case name prefix
+    s = (q or "").strip()
+    compact = "".join([ch for ch in s.upper() if ch not in " :-"])
+    return compact, s.lower()
+
+
+def uids_page(after="", limit=UIDS_PAGE_DEFAULT, q=""):
+    """
+    Cursor page over the sorted UID order.
+    after: last UID of the previous page ("" = from the start).
+    q: optional UID or name prefix.
+    Returns (cards, next_cursor or None).
+    """
+    try:
+        limit = int(limit)
+    except:
+        limit = UIDS_PAGE_DEFAULT
+    limit = max(1, min(UIDS_PAGE_MAX, limit))
+
+    i = _bisect_right(UIDS_SORTED, after) if after else 0
+    n = len(UIDS_SORTED)
+    compact, low = _search_key(q)
     out = []
-    for hx in sorted(list(ALLOWED_UIDS_HEX)):
-        out.append({"uid": hx, "name": UID_NAME_BY_HEX.get(hx, "")})
-    return out
+    while i < n and len(out) < limit:
+        hx = UIDS_SORTED[i]
+        i += 1
+        nm = UID_NAME_BY_HEX.get(hx, "")
+        if compact or low:
+            if not (hx.replace(" ", "").startswith(compact) or (low and nm.lower().startswith(low))):
+                continue
+        out.append({"uid": hx, "name": nm})
+
+    nxt = out[-1]["uid"] if (len(out) == limit and i < n) else None
+    return out, nxt
+
+
+class _LineSplit:
+    """
+    Push-side line splitter: feed(chunk) returns the lines (bytes, no line
+    end) completed by chunk, tail() the unterminated last one.
+    Only one partial line is buffered; longer than UIDS_LINE_MAX is dropped.
+    """
+
+    def __init__(self):
+        self.buf = b""
+        self.skip = False
+
+    def feed(self, chunk):
+        out = []
+        buf = self.buf + chunk
+        while True:
+            i = buf.find(b"\n")
+            if i < 0:
+                break
+            if not self.skip:
+                out.append(buf[:i])
+            self.skip = False
+            buf = buf[i + 1:]
+        if len(buf) > UIDS_LINE_MAX:
+            buf = b""
+            self.skip = True
+        self.buf = buf
+        return out
+
+    def tail(self):
+        buf = self.buf
+        self.buf = b""
+        return buf if (buf and not self.skip) else None
+
+
+def _iter_lines(read, bufsize=256):
+    """Yield lines (bytes, no line end) from read(n) until it returns b""."""
+    ls = _LineSplit()
+    while True:
+        chunk = read(bufsize)
+        if not chunk:
+            break
+        for line in ls.feed(chunk):
+            yield line
+    line = ls.tail()
+    if line is not None:
+        yield line
+
+
+def _parse_card_line(line, fmt="jsonl"):
+    """
+    One card line -> (uid_hex, name), or None for blank/header/bad lines.
+    jsonl: {"uid": "..", "name": ".."} (a trailing comma is allowed, so the
+           lines of uids.json parse too)
+    csv:   uid,name   (name may be "quoted" with "" escapes)
+    """
+    try:
+        s = line.decode().strip()
+        if not s:
+            return None
+        if fmt == "csv":
+            i = s.find(",")
+            uid = (s if i < 0 else s[:i]).strip()
+            nm = "" if i < 0 else s[i + 1:].strip()
+            if uid.lower() == "uid":
+                return None  # header
+            if len(nm) >= 2 and nm[0] == '"' and nm[-1] == '"':
+                nm = nm[1:-1].replace('""', '"')
+            return uid, nm
+        if s[-1] == ",":
+            s = s[:-1]
+        if s[0] != "{":
+            return None
+        j = ujson.loads(s)
+        uid = j.get("uid")
+        if not uid:
+            return None
+        return str(uid), str(j.get("name") or "")
+    except:
+        return None
+
+
+def _card_line(hx, nm, fmt="jsonl"):
+    if fmt == "csv":
+        nm = nm.replace("\r", " ").replace("\n", " ")
+        if "," in nm or '"' in nm:
+            nm = '"' + nm.replace('"', '""') + '"'
+        return "{},{}\n".format(hx, nm)
+    return ujson.dumps({"uid": hx, "name": nm}) + "\n"
 
 
-def uids_list_hex():
-    return [c["uid"] for c in uids_list_cards()]
+_UIDS_FILE_HEAD = '{"cards":['
 
 
 def _load_uids_file_or_init():
     global ALLOWED_UIDS, ALLOWED_UIDS_HEX, UID_NAME_BY_HEX
     UID_NAME_BY_HEX = {}
     try:
+        tmp = set()
+
+        # Current format, one card per line: read it as a stream
+        with open(UIDS_FILE, "rb") as f:
+            head = f.readline()
+            if head.strip() == _UIDS_FILE_HEAD.encode():
+                for line in _iter_lines(f.read):
+                    c = _parse_card_line(line)
+                    b = uid_hex_to_bytes(c[0]) if c else None
+                    if b:
+                        tmp.add(b)
+                        UID_NAME_BY_HEX[uid_bytes_to_hex(b)] = c[1].strip()
+                ALLOWED_UIDS = tmp
+                _sync_hex_set_from_bytes()
+                log("UIDS", "loaded cards:", len(ALLOWED_UIDS))
+                return True
+
+        # Older single-line files: parse whole, then rewrite line by line
         with open(UIDS_FILE, "r") as f:
             j = ujson.load(f)
 
-        tmp = set()
-
-        # NEW format
+        # {"cards":[...]} on one line
         if "cards" in j and isinstance(j.get("cards"), list):
             for item in j.get("cards", []):
                 hx = (item.get("uid") or "").strip()
@@ -266,7 +608,8 @@ def _load_uids_file_or_init():
                     UID_NAME_BY_HEX[uid_bytes_to_hex(b)] = nm or ""
             ALLOWED_UIDS = tmp
             _sync_hex_set_from_bytes()
-            log("UIDS", "loaded cards:", len(ALLOWED_UIDS))
+            log("UIDS", "loaded cards (single line):", len(ALLOWED_UIDS))
+            _save_uids_file()
             return True
 
         # OLD format compatibility: {"uids":[...]}
@@ -311,21 +654,26 @@ def _load_uids_file_or_init():
     return True
 
 
-def _save_uids_file():
-    try:
-        _sync_hex_set_from_bytes()
-        cards = []
-        for hx in sorted(list(ALLOWED_UIDS_HEX)):
-            cards.append({"uid": hx, "name": UID_NAME_BY_HEX.get(hx, "")})
-        with open(UIDS_FILE, "w") as f:
-            ujson.dump({"cards": cards}, f)
-        return True
-    except Exception as e:
-        log("UIDS", "save error:", e)
-        return False
+def _save_uids_file(path=UIDS_FILE):
+    # Still valid JSON, but one card per line so it can be read back as a
+    # stream (see _load_uids_file_or_init); written card by card.
+    with trace("flash.uids"):
+        try:
+            with open(path, "w") as f:
+                f.write(_UIDS_FILE_HEAD)
+                sep = "\n"
+                for hx in UIDS_SORTED:
+                    f.write(sep)
+                    f.write(ujson.dumps({"uid": hx, "name": UID_NAME_BY_HEX.get(hx, "")}))
+                    sep = ",\n"
+                f.write("\n]}\n")
+            return True
+        except Exception as e:
+            log_err("UIDS", "save error:", e)
+            return False
 
 
-def uids_add(uid_hex: str, name: str = ""):
+def uids_add(uid_hex: str, name: str = "", save=True):
     global ALLOWED_UIDS
     b = uid_hex_to_bytes(uid_hex)
     if not b:
@@ -335,17 +683,20 @@ def uids_add(uid_hex: str, name: str = ""):
     if b in ALLOWED_UIDS:
         if name is not None and str(name).strip() != "":
             UID_NAME_BY_HEX[hx] = str(name).strip()
-            _save_uids_file()
+            _db_touch("rename", hx)
+            if save:
+                _save_uids_file()
             return True, "Name updated: {} -> {}".format(hx, UID_NAME_BY_HEX[hx])
         return True, "Already exists"
 
-    ALLOWED_UIDS.add(b)
+    _index_add(b, hx)
     UID_NAME_BY_HEX[hx] = (str(name).strip() if name else "")
-    ok = _save_uids_file()
+    _db_touch("add", hx)
+    ok = _save_uids_file() if save else True
     return bool(ok), "Added: {}".format(hx)
 
 
-def uids_remove(uid_hex: str):
+def uids_remove(uid_hex: str, save=True):
     global ALLOWED_UIDS
     b = uid_hex_to_bytes(uid_hex)
     if not b:
@@ -354,18 +705,19 @@ def uids_remove(uid_hex: str):
     if b not in ALLOWED_UIDS:
         return False, "Not found"
 
-    ALLOWED_UIDS.remove(b)
+    _index_remove(b, hx)
     try:
         if hx in UID_NAME_BY_HEX:
             del UID_NAME_BY_HEX[hx]
     except:
         pass
 
-    ok = _save_uids_file()
+    _db_touch("remove", hx)
+    ok = _save_uids_file() if save else True
     return bool(ok), "Removed: {}".format(hx)
 
 
-def uids_set_name(uid_hex: str, name: str):
+def uids_set_name(uid_hex: str, name: str, save=True):
     b = uid_hex_to_bytes(uid_hex)
     if not b:
         return False, "Bad UID format"
@@ -374,38 +726,433 @@ def uids_set_name(uid_hex: str, name: str):
         return False, "Not found"
 
     UID_NAME_BY_HEX[hx] = (str(name).strip() if name else "")
-    ok = _save_uids_file()
+    _db_touch("rename", hx)
+    ok = _save_uids_file() if save else True
     return bool(ok), "Renamed: {} -> {}".format(hx, UID_NAME_BY_HEX[hx])
 
 
+def uids_batch(ops):
+    """
+    Apply many operations in memory and write uids.json once.
+    ops: [{"op": "add"|"remove"|"rename", "uid": "..", "name": ".."}]
+    Returns (saved_ok, [{"ok": bool, "msg": str}, ...]) in input order.
+    """
+    global _index_bulk
+    v0 = DB_VERSION
+    used = _card_stats_used()
+    _index_bulk = True
+    try:
+        results = _uids_batch_apply(ops)
+    finally:
+        _index_bulk = False
+        _card_stats_rebuild(used)
+
+    saved = _save_uids_file() if DB_VERSION != v0 else True
+    return bool(saved), results
+
+
+def _uids_batch_apply(ops):
+    results = []
+    for o in ops:
+        if not isinstance(o, dict):
+            results.append({"ok": False, "msg": "Bad op"})
+            continue
+        op = o.get("op") or ""
+        uid = o.get("uid") or o.get("uid_hex") or ""
+        try:
+            if op == "add":
+                ok, msg = uids_add(uid, o.get("name", ""), save=False)
+            elif op == "remove":
+                ok, msg = uids_remove(uid, save=False)
+            elif op in ("rename", "set_name"):
+                ok, msg = uids_set_name(uid, o.get("name", ""), save=False)
+            else:
+                ok, msg = False, "Unknown op: {}".format(op)
+        except Exception as e:
+            ok, msg = False, "Error: {}".format(e)
+        results.append({"ok": bool(ok), "msg": msg})
+    return results
+
+
 def uids_clear_all():
     global ALLOWED_UIDS, UID_NAME_BY_HEX
     ALLOWED_UIDS = set()
     UID_NAME_BY_HEX = {}
+    _sync_hex_set_from_bytes()
+    _db_touch()
     ok = _save_uids_file()
     return bool(ok)
 
 
+# -----------------------
+# ACCESS LOG (flash)
+# -----------------------
+# Record: seq u32, time u32 (device clock, s), uid_len u8, decision u8
+# (1 granted, 0 denied), reader u8, flags u8 (bit0 = valid), uid 10 B, pad.
+# Record seq lives at slot seq % ACCESS_LOG_MAX, so any record is one seek
+# away and the write position is found at boot by binary search.
+_ALOG_FMT = "<IIBBBB10s2x"
+_ALOG_REC = 24
+_ALOG_VALID = 1
+_alog_next = 0             # seq of the next record
+_alog_buf = bytearray(_ALOG_REC * ACCESS_LOG_BATCH * 2)
+_alog_pending = 0          # records in _alog_buf
+_alog_t = 0                # first pending record time (ms)
+ACCESS_LOG_STATS = {"written": 0, "flushes": 0, "dropped": 0, "errors": 0}
+
+
+def _alog_read(f, slot, buf):
+    f.seek(slot * _ALOG_REC)
+    if f.readinto(buf) != _ALOG_REC:
+        return None
+    r = ustruct.unpack(_ALOG_FMT, buf)
+    return r if (r[5] & _ALOG_VALID) else None
+
+
+def _access_log_open():
+    """Create the file at full size if needed and find the next seq."""
+    global _alog_next
+    size = ACCESS_LOG_MAX * _ALOG_REC
+    try:
+        import os
+        if os.stat(ACCESS_LOG_FILE)[6] != size:
+            raise OSError
+    except OSError:
+        try:
+            with open(ACCESS_LOG_FILE, "wb") as f:
+                zero = bytes(_ALOG_REC * 32)
+                left = size
+                while left > 0:
+                    f.write(zero[:min(left, len(zero))])
+                    left -= len(zero)
+            log("ALOG", "created", ACCESS_LOG_FILE, size, "B")
+        except Exception as e:
+            log_err("ALOG", "create error:", e)
+        _alog_next = 0
+        return
+
+    buf = bytearray(_ALOG_REC)
+    try:
+        with open(ACCESS_LOG_FILE, "rb") as f:
+            r = _alog_read(f, 0, buf)
+            if r is None:
+                _alog_next = 0
+                return
+            base = r[0]  # lap start: slot i holds base + i up to the write position
+            lo, hi = 1, ACCESS_LOG_MAX
+            while lo < hi:
+                mid = (lo + hi) // 2
+                r = _alog_read(f, mid, buf)
+                if r is not None and r[0] == base + mid:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            _alog_next = base + lo
+    except Exception as e:
+        log_err("ALOG", "open error:", e)
+        _alog_next = 0
+    log("ALOG", "next record:", _alog_next)
+
+
+def access_log_add(uid, granted):
+    """Queue one tap (RAM only; written by access_log_tick)."""
+    global _alog_pending, _alog_t
+    if _alog_pending * _ALOG_REC >= len(_alog_buf):
+        ACCESS_LOG_STATS["dropped"] += 1
+        return
+    if not _alog_pending:
+        _alog_t = now_ms()
+    n = min(len(uid), 10)
+    ustruct.pack_into(_ALOG_FMT, _alog_buf, _alog_pending * _ALOG_REC,
+                      0, int(time.time()), n, 1 if granted else 0, READER_ID, _ALOG_VALID, bytes(uid[:n]))
+    _alog_pending += 1
+
+
+def access_log_flush():
+    """Write pending records: one open, a seek per ring wrap."""
+    global _alog_next, _alog_pending
+    if not _alog_pending:
+        return
+    with trace("flash.access_log"):
+        try:
+            with open(ACCESS_LOG_FILE, "r+b") as f:
+                mv = memoryview(_alog_buf)
+                slot = -1
+                for i in range(_alog_pending):
+                    off = i * _ALOG_REC
+                    ustruct.pack_into("<I", _alog_buf, off, _alog_next + i)
+                    s_i = (_alog_next + i) % ACCESS_LOG_MAX
+                    if s_i != slot:
+                        f.seek(s_i * _ALOG_REC)
+                    f.write(mv[off:off + _ALOG_REC])
+                    slot = s_i + 1
+            _alog_next += _alog_pending
+            ACCESS_LOG_STATS["written"] += _alog_pending
+            ACCESS_LOG_STATS["flushes"] += 1
+        except Exception as e:
+            ACCESS_LOG_STATS["errors"] += 1
+            log_err("ALOG", "write error:", e)
+        _alog_pending = 0
+
+
+def access_log_tick():
+    if _alog_pending and (_alog_pending >= ACCESS_LOG_BATCH or ms_diff(now_ms(), _alog_t) >= ACCESS_LOG_FLUSH_MS):
+        access_log_flush()
+
+
+def access_log_query(since=0, uid=None, limit=100):
+    """Yield (seq, t, uid_hex, granted, reader) oldest first, read from flash a few records at a time."""
+    access_log_flush()
+    seq = max(since, _alog_next - ACCESS_LOG_MAX, 0)
+    end = _alog_next
+    blk = 16
+    buf = bytearray(_ALOG_REC * blk)
+    n = 0
+    with open(ACCESS_LOG_FILE, "rb") as f:
+        while seq < end and n < limit:
+            slot = seq % ACCESS_LOG_MAX
+            cnt = min(blk, end - seq, ACCESS_LOG_MAX - slot)
+            f.seek(slot * _ALOG_REC)
+            mv = memoryview(buf)[:cnt * _ALOG_REC]
+            f.readinto(mv)
+            for i in range(cnt):
+                r = ustruct.unpack_from(_ALOG_FMT, buf, i * _ALOG_REC)
+                if not (r[5] & _ALOG_VALID) or r[0] != seq + i:
+                    continue
+                u = r[6][:r[2]]
+                if uid is not None and u != uid:
+                    continue
+                yield r[0], r[1], uid_bytes_to_hex(u), r[3] == 1, r[4]
+                n += 1
+                if n >= limit:
+                    break
+            seq += cnt
+
+
+# -----------------------
+# TAP FILTER
+# -----------------------
+# One entry per recently seen card: [seen_ms, window_start_ms, taps_in_window,
+# denied_in_a_row, lockout_start_ms]. A suppressed read skips the LED,
+# Telegram, SSE and flash work of a tap.
+_TAP_TABLE = {}    # uid bytes -> entry
+TAP_FILTER_STATS = {"accepted": 0, "debounced": 0, "rate_limited": 0, "locked_out": 0, "evicted": 0}
+
+
+def _tap_admit(uid, t):
+    """Returns (entry, None) when the read should be processed, else (entry, reason)."""
+    e = _TAP_TABLE.get(uid)
+    if e is None:
+        if len(_TAP_TABLE) >= TAP_TABLE_SIZE:
+            oldest = None
+            for k in _TAP_TABLE:
+                if oldest is None or ms_diff(_TAP_TABLE[oldest][0], _TAP_TABLE[k][0]) > 0:
+                    oldest = k
+            del _TAP_TABLE[oldest]
+            TAP_FILTER_STATS["evicted"] += 1
+        e = [t, t, 0, 0, 0]
+        _TAP_TABLE[uid] = e
+        reason = None
+    else:
+        seen = e[0]
+        e[0] = t
+        if e[3] >= TAP_DENY_LOCKOUT_AFTER:
+            if ms_diff(t, e[4]) < TAP_DENY_LOCKOUT_MS:
+                reason = "locked_out"
+            else:
+                e[3] = 0
+                reason = None
+        elif ms_diff(t, seen) < TAP_DEBOUNCE_MS:
+            reason = "debounced"
+        else:
+            reason = None
+        if reason is None and TAP_RATE_MAX > 0:
+            if ms_diff(t, e[1]) >= TAP_RATE_WINDOW_MS:
+                e[1] = t
+                e[2] = 0
+            elif e[2] >= TAP_RATE_MAX:
+                reason = "rate_limited"
+    if reason:
+        TAP_FILTER_STATS[reason] += 1
+        return e, reason
+    e[2] += 1
+    TAP_FILTER_STATS["accepted"] += 1
+    return e, None
+
+
+def _tap_decided(e, granted, t):
+    """Feed the decision back: repeated denials start a lockout."""
+    if granted:
+        e[3] = 0
+        return False
+    e[3] += 1
+    if e[3] >= TAP_DENY_LOCKOUT_AFTER:
+        e[4] = t
+        return True
+    return False
+
+
+# -----------------------
+# CARD USAGE STATS
+# -----------------------
+# Counters live in RAM (CARD_TAPS / CARD_LAST next to UIDS_SORTED, unknown
+# UIDs in DENIED_UNKNOWN) and reach flash every CARD_STATS_FLUSH_MS.
+# File lines: "A,<uid hex>,<taps>,<last>" and "D,<uid hex>,<attempts>,<last>".
+_card_stats_dirty = False
+_card_stats_t = 0
+
+
+def _card_stats_used():
+    """uid hex -> (taps, last) for cards with any usage."""
+    out = {}
+    for i in range(min(len(UIDS_SORTED), len(CARD_TAPS))):
+        if CARD_TAPS[i] or CARD_LAST[i]:
+            out[UIDS_SORTED[i]] = (CARD_TAPS[i], CARD_LAST[i])
+    return out
+
+
+def _card_stats_rebuild(used):
+    global CARD_TAPS, CARD_LAST
+    n = len(UIDS_SORTED)
+    CARD_TAPS = array("I", [0] * n)
+    CARD_LAST = array("I", [0] * n)
+    for hx in used:
+        i = _card_index(hx)
+        if i >= 0:
+            CARD_TAPS[i], CARD_LAST[i] = used[hx]
+
+
+def card_stats_tap(hx, granted):
+    """Count one tap (RAM only)."""
+    global _card_stats_dirty
+    t = int(time.time())
+    if granted:
+        i = _card_index(hx)
+        if i >= 0:
+            CARD_TAPS[i] += 1
+            CARD_LAST[i] = t
+    else:
+        d = DENIED_UNKNOWN.get(hx)
+        if d is None:
+            if len(DENIED_UNKNOWN) >= DENIED_UNKNOWN_MAX:
+                oldest = None
+                for k in DENIED_UNKNOWN:
+                    if oldest is None or DENIED_UNKNOWN[k][1] < DENIED_UNKNOWN[oldest][1]:
+                        oldest = k
+                del DENIED_UNKNOWN[oldest]
+            DENIED_UNKNOWN[hx] = [1, t]
+        else:
+            d[0] += 1
+            d[1] = t
+    _card_stats_dirty = True
+
+
+def card_stats_load():
+    try:
+        with open(CARD_STATS_FILE) as f:
+            for line in f:
+                p = line.strip().split(",")
+                if len(p) != 4:
+                    continue
+                if p[0] == "A":
+                    i = _card_index(p[1])
+                    if i >= 0:
+                        CARD_TAPS[i] = int(p[2])
+                        CARD_LAST[i] = int(p[3])
+                elif p[0] == "D" and len(DENIED_UNKNOWN) < DENIED_UNKNOWN_MAX:
+                    DENIED_UNKNOWN[p[1]] = [int(p[2]), int(p[3])]
+    except OSError:
+        pass
+    except Exception as e:
+        log_err("STATS", "load error:", e)
+
+
+def card_stats_flush():
+    global _card_stats_dirty, _card_stats_t
+    _card_stats_t = now_ms()
+    if not _card_stats_dirty:
+        return
+    with trace("flash.card_stats"):
+        try:
+            with open(CARD_STATS_FILE, "w") as f:
+                for i in range(len(UIDS_SORTED)):
+                    if CARD_TAPS[i] or CARD_LAST[i]:
+                        f.write("A,{},{},{}\n".format(UIDS_SORTED[i], CARD_TAPS[i], CARD_LAST[i]))
+                for hx in DENIED_UNKNOWN:
+                    d = DENIED_UNKNOWN[hx]
+                    f.write("D,{},{},{}\n".format(hx, d[0], d[1]))
+            _card_stats_dirty = False
+        except Exception as e:
+            log_err("STATS", "save error:", e)
+
+
+def card_stats_tick():
+    if _card_stats_dirty and ms_diff(now_ms(), _card_stats_t) >= CARD_STATS_FLUSH_MS:
+        card_stats_flush()
+
+
+def card_stats_report(sort="stale", limit=20):
+    """(cards, never_used, denied): cards as (hx, taps, last), sorted stale-first or by taps."""
+    idx = list(range(len(UIDS_SORTED)))
+    if sort == "top":
+        idx.sort(key=lambda i: CARD_TAPS[i], reverse=True)
+    else:
+        idx.sort(key=lambda i: CARD_LAST[i])
+    cards = [(UIDS_SORTED[i], CARD_TAPS[i], CARD_LAST[i]) for i in idx[:limit]]
+    never = 0
+    for i in range(len(CARD_TAPS)):
+        if not CARD_TAPS[i]:
+            never += 1
+    denied = sorted([(hx, DENIED_UNKNOWN[hx][0], DENIED_UNKNOWN[hx][1]) for hx in DENIED_UNKNOWN],
+                    key=lambda x: x[1], reverse=True)
+    return cards, never, denied
+
+
 # -----------------------
 # SESSION MANAGEMENT
 # -----------------------
-SESSIONS = {}  # {"session_id": timestamp_ms}
+SESSIONS = {}  # {16-byte session id: last use ms}; cookie carries it as 32 hex chars
 SESSION_TIMEOUT_MS = 3600000  # 1 hour
+SESSION_MAX = 16              # table size; the least recently used session is evicted
+SESSION_SWEEP_MS = 60000      # expired sessions are dropped at least this often
+
+SESSION_STATS = {"created": 0, "evicted": 0, "expired": 0}
+_session_last_sweep = 0
 
 def _generate_session_id():
-    """Generate a random session ID using MicroPython-compatible method"""
+    """Generate a random 128-bit session ID (bytes) using MicroPython-compatible method"""
     # MicroPython allows getrandbits() only up to 32 bits
     try:
         import urandom
-        r1 = urandom.getrandbits(32)
-        r2 = urandom.getrandbits(32)
-        r3 = urandom.getrandbits(32)
-        r4 = urandom.getrandbits(32)
-        # Generate 128-bit session ID (32 hex chars)
-        return "{:08x}{:08x}{:08x}{:08x}".format(r1, r2, r3, r4)
+        return bytes([urandom.getrandbits(8) for _ in range(16)])
     except:
         # Fallback: use timestamp-based session ID
-        return "sess-{}".format(now_ms())
+        t = now_ms()
+        return bytes([(t >> (8 * (i % 4))) & 0xFF for i in range(16)])
+
+def _sid_from_cookie(value):
+    """Cookie value (32 hex chars) -> session id bytes, or None"""
+    if len(value) != 32:
+        return None
+    try:
+        import ubinascii
+        return ubinascii.unhexlify(value)
+    except:
+        return None
+
+def _session_sweep(now=None):
+    """Drop expired sessions"""
+    global _session_last_sweep
+    now = now_ms() if now is None else now
+    _session_last_sweep = now
+    for sid in [k for k, t in SESSIONS.items() if ms_diff(now, t) > SESSION_TIMEOUT_MS]:
+        del SESSIONS[sid]
+        SESSION_STATS["expired"] += 1
+
+def _session_tick():
+    # called every loop iteration
+    if ms_diff(now_ms(), _session_last_sweep) >= SESSION_SWEEP_MS:
+        _session_sweep()
 
 def _parse_cookies(headers):
     """Parse cookies from headers into a dict"""
@@ -419,43 +1166,54 @@ def _parse_cookies(headers):
                 cookies[k.strip()] = v.strip()
     return cookies
 
-def _check_session(headers):
+def _check_session(req):
     """Check if request has valid session cookie"""
     if not UI_AUTH_ENABLED or not UI_USER or not UI_PASS:
         return True  # Auth disabled
     
-    cookies = _parse_cookies(headers)
-    sess_id = cookies.get("sess", "")
+    sid = _sid_from_cookie(req.cookies().get("sess", ""))
     
-    if not sess_id or sess_id not in SESSIONS:
+    if not sid or sid not in SESSIONS:
         return False
     
     # Check session timeout
     now = now_ms()
-    if ms_diff(now, SESSIONS[sess_id]) > SESSION_TIMEOUT_MS:
+    if ms_diff(now, SESSIONS[sid]) > SESSION_TIMEOUT_MS:
         try:
-            del SESSIONS[sess_id]
+            del SESSIONS[sid]
+            SESSION_STATS["expired"] += 1
         except:
             pass
         return False
     
-    # Update session timestamp
-    SESSIONS[sess_id] = now
+    # Update session timestamp (LRU order)
+    SESSIONS[sid] = now
     return True
 
 def _create_session():
-    """Create a new session and return session ID"""
-    sess_id = _generate_session_id()
-    SESSIONS[sess_id] = now_ms()
-    return sess_id
-
-def _destroy_session(headers):
+    """Create a new session and return its cookie value"""
+    now = now_ms()
+    if len(SESSIONS) >= SESSION_MAX:
+        _session_sweep(now)
+    if len(SESSIONS) >= SESSION_MAX:
+        oldest = None
+        for k, t in SESSIONS.items():
+            if oldest is None or ms_diff(t, SESSIONS[oldest]) < 0:
+                oldest = k
+        del SESSIONS[oldest]
+        SESSION_STATS["evicted"] += 1
+
+    sid = _generate_session_id()
+    SESSIONS[sid] = now
+    SESSION_STATS["created"] += 1
+    return "".join(["{:02x}".format(b) for b in sid])
+
+def _destroy_session(req):
     """Destroy session from cookie"""
-    cookies = _parse_cookies(headers)
-    sess_id = cookies.get("sess", "")
-    if sess_id and sess_id in SESSIONS:
+    sid = _sid_from_cookie(req.cookies().get("sess", ""))
+    if sid and sid in SESSIONS:
         try:
-            del SESSIONS[sess_id]
+            del SESSIONS[sid]
         except:
             pass
 
@@ -466,11 +1224,11 @@ def _redirect(cl, location):
             "HTTP/1.1 302 Found\r\n"
             "Location: {}\r\n"
             "Content-Length: 0\r\n"
-            "Connection: close\r\n\r\n"
-        ).format(location)
+            "{}\r\n"
+        ).format(location, _conn_hdr(cl))
         cl.send(hdr.encode())
     except:
-        pass
+        _send_failed(cl)
 
 def _set_cookie_redirect(cl, location, sess_id):
     """Send redirect with Set-Cookie header"""
@@ -480,11 +1238,11 @@ def _set_cookie_redirect(cl, location, sess_id):
             "Location: {}\r\n"
             "Set-Cookie: sess={}; Path=/; HttpOnly; Max-Age=3600\r\n"
             "Content-Length: 0\r\n"
-            "Connection: close\r\n\r\n"
-        ).format(location, sess_id)
+            "{}\r\n"
+        ).format(location, sess_id, _conn_hdr(cl))
         cl.send(hdr.encode())
     except:
-        pass
+        _send_failed(cl)
 
 def _clear_cookie_redirect(cl, location):
     """Send redirect with cookie deletion"""
@@ -494,139 +1252,879 @@ def _clear_cookie_redirect(cl, location):
             "Location: {}\r\n"
             "Set-Cookie: sess=; Path=/; HttpOnly; Max-Age=0\r\n"
             "Content-Length: 0\r\n"
-            "Connection: close\r\n\r\n"
-        ).format(location)
+            "{}\r\n"
+        ).format(location, _conn_hdr(cl))
         cl.send(hdr.encode())
     except:
-        pass
+        _send_failed(cl)
 
 # -----------------------
 # HTTP helpers
 # -----------------------
-def _read_http_request(cl):
-    try:
-        cl.settimeout(1.0)
-        data = cl.recv(2048)
-        if not data:
-            return None
-
-        t0 = time.ticks_ms()
-        while (b"\r\n\r\n" not in data) and (time.ticks_diff(time.ticks_ms(), t0) < 250):
-            try:
-                more = cl.recv(2048)
-                if not more:
-                    break
-                data += more
-            except:
-                break
+def _parse_http_head(head):
+    """Request line + header block (bytes, without the blank line) -> (method, path, version, headers)."""
+    lines = head.split(b"\r\n")
+    method, path, version = lines[0].decode().split(" ", 2)
 
-        head, body = (data.split(b"\r\n\r\n", 1) + [b""])[:2]
-        lines = head.split(b"\r\n")
-        if not lines:
-            return None
+    headers = {}
+    for ln in lines[1:]:
+        if b":" in ln:
+            k, v = ln.split(b":", 1)
+            headers[k.strip().lower().decode()] = v.strip().decode()
+    return method, path, version, headers
 
-        req_line = lines[0].decode()
-        method, path, _ = req_line.split(" ", 2)
-
-        headers = {}
-        for ln in lines[1:]:
-            if b":" in ln:
-                k, v = ln.split(b":", 1)
-                headers[k.strip().lower().decode()] = v.strip().decode()
-
-        cl_len = int(headers.get("content-length", "0") or "0")
-        if cl_len > len(body):
-            need = cl_len - len(body)
-            while need > 0:
-                chunk = cl.recv(min(2048, need))
-                if not chunk:
-                    break
-                body += chunk
-                need -= len(chunk)
 
-        return method, path, headers, body
-    except Exception as e:
-        if DEBUG_ERRORS and getattr(e, "errno", None) != 116:
-            log("HTTP", "read error:", e)
-        return None
+def _conn_hdr(cl):
+    return "Connection: keep-alive\r\n" if cl.keepalive else "Connection: close\r\n"
 
 
-def _http_send(cl, status="200 OK", ctype="text/plain; charset=utf-8", body=""):
+def _send_failed(cl):
+    # Response may be cut: the socket cannot carry another request
     try:
-        body_b = body.encode() if isinstance(body, str) else body
-        hdr = "HTTP/1.1 {}\r\nContent-Type: {}\r\nContent-Length: {}\r\nConnection: close\r\n\r\n".format(
-            status, ctype, len(body_b)
-        )
-        cl.send(hdr.encode() + body_b)
+        cl.keepalive = False
     except:
         pass
 
 
-def _json_response(cl, obj, status="200 OK"):
-    _http_send(cl, status=status, ctype="application/json", body=ujson.dumps(obj))
+_EAGAIN = (errno.EAGAIN, errno.ETIMEDOUT)
+
+_POLLER = select.poll()
+_CONNS = {}              # socket -> _Conn
+
+# Accept-queue accounting. A connection can have waited in the backlog at most
+# since the previous poll (or since the last drain that had to stop early).
+HTTP_STATS = {
+    "accepted": 0,
+    "deferred": 0,          # drains stopped by the connection cap or time budget
+    "accept_wait_last_ms": 0,
+    "accept_wait_max_ms": 0,
+    "accept_wait_sum_ms": 0,
+    "keepalive_reused": 0,   # requests served on an already used socket
+    "keepalive_evicted": 0,
+    "out_overflow": 0,       # responses dropped: more than HTTP_OUT_MAX queued
+    "send_timeouts": 0,      # clients that stopped reading
+    "rate_limited": 0,       # fast 429s (client over its token bucket)
+    "shed": 0,               # fast 503s (all sockets busy for HTTP_SHED_AFTER_MS)
+    "budget_deferred": 0,    # ready sockets left for the next loop (HTTP_LOOP_BUDGET_MS spent)
+    "budget_spent_max_ms": 0,
+}
+_last_poll_ms = 0
+_accept_pending_since = 0   # 0 = backlog was fully drained
+_http_spent_ms = 0          # HTTP work in the current main-loop iteration
+_http_deadline = 0          # end of the budget for the running _http_poll()
+
+# Fixed replies for the overload paths: no parsing, no allocation
+_FAST_429 = b"HTTP/1.1 429 Too Many Requests\r\nRetry-After: 1\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+_FAST_503 = b"HTTP/1.1 503 Service Unavailable\r\nRetry-After: 1\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+
+_RATE = {}  # client ip -> [tokens * 1000, last refill ms]
+
+
+class _Conn:
+    """
+    One client socket with an incremental request parser:
+    HEAD (collect headers) -> BODY (fill Content-Length bytes) -> DONE.
+    Reads happen only when poll reports the socket readable, so a slow
+    client never blocks the main loop. After a handler keeps the socket
+    (SSE) the connection moves to STREAM and only hangups are watched.
+    HTTP_STREAM_BODY routes skip BODY: the handler sets req.sink and the
+    body is fed to it chunk by chunk in SINK, across poll rounds.
+
+    Output is never written blocking: send() queues what the socket does
+    not take right away (memoryview slices, no copies) and send_iter()
+    attaches a producer that is pulled only as the socket drains. While
+    output is pending the socket is polled for POLLOUT instead of POLLIN,
+    so the next kept-alive request waits until this response is out.
+    """
+    HEAD = 0
+    BODY = 1
+    DONE = 2
+    STREAM = 3
+    SINK = 4
+
+    def __init__(self, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        self.ip = addr[0] if isinstance(addr, tuple) else addr
+        self.t0 = now_ms()
+        self.state = _Conn.HEAD
+        self.buf = b""
+        self.method = None
+        self.path = None
+        self.version = None
+        self.headers = None
+        self.body = None
+        self.got = 0
+        self.sink = None        # SINK: body consumer, got = body bytes still to come
+        self.t_read = 0         # SINK: last body bytes received
+        self.rest = b""         # bytes after the body (next pipelined request)
+        self.nreq = 0           # requests already served on this socket
+        self.keepalive = False  # decided per request by _http_keepalive_ok()
+        self.out = []           # queued memoryviews
+        self.out_bytes = 0
+        self.pull = None        # iterator of further response pieces (send_iter)
+        self.t_write = 0        # last write progress
+        self.closing = False    # close once the output is drained
+        self.events = select.POLLIN
+        self.status = 0         # response status code, taken from the first bytes sent
+
+    def feed(self, data):
+        """Consume received bytes. True when a full request is parsed."""
+        if self.state == _Conn.HEAD:
+            if not self.buf:
+                self.t0 = now_ms()  # request timer starts with its first byte
+            self.buf += data
+            i = self.buf.find(b"\r\n\r\n")
+            if i < 0:
+                if len(self.buf) > HTTP_MAX_HEADER:
+                    raise ValueError("431 Request Header Fields Too Large")
+                return False
+            if i > HTTP_MAX_HEADER:
+                raise ValueError("431 Request Header Fields Too Large")
 
+            try:
+                self.method, self.path, self.version, self.headers = _parse_http_head(self.buf[:i])
+                need = int(self.headers.get("content-length", "0") or "0")
+            except:
+                raise ValueError("400 Bad Request")
+            if need < 0:
+                raise ValueError("400 Bad Request")
+            p = self.path.find("?")
+            base = self.path if p < 0 else self.path[:p]
+            if base in HTTP_STREAM_BODY:
+                if need > HTTP_STREAM_BODY[base]:
+                    raise ValueError("413 Payload Too Large")
+                # Handler takes the body via req.sink; keep what came with the head
+                self.buf = self.buf[i + 4:]
+                self.got = need
+                self.state = _Conn.DONE
+                return True
+            if need > HTTP_BODY_LIMITS.get(base, HTTP_MAX_BODY):
+                raise ValueError("413 Payload Too Large")
+
+            data = self.buf[i + 4:]
+            self.buf = b""
+            self.body = bytearray(need)
+            self.got = 0
+            self.state = _Conn.BODY
+
+        if self.state == _Conn.BODY:
+            n = min(len(data), len(self.body) - self.got)
+            if n:
+                self.body[self.got:self.got + n] = data[:n]
+                self.got += n
+            if self.got >= len(self.body):
+                self.rest = data[n:]
+                self.state = _Conn.DONE
+                return True
+        return False
 
-def _sse_headers():
-    return (
-        "HTTP/1.1 200 OK\r\n"
-        "Content-Type: text/event-stream\r\n"
-        "Cache-Control: no-cache\r\n"
-        "Connection: keep-alive\r\n\r\n"
-    )
+    def reset(self):
+        """Back to HEAD for the next request on a kept-alive socket; returns bytes already received for it."""
+        rest = self.rest
+        self.rest = b""
+        self.nreq += 1
+        self.t0 = now_ms()
+        self.state = _Conn.HEAD
+        self.buf = b""
+        self.method = None
+        self.path = None
+        self.version = None
+        self.headers = None
+        self.body = None
+        self.got = 0
+        self.keepalive = False
+        self.status = 0
+        return rest
+
+    def idle(self):
+        """Kept-alive socket waiting for its next request."""
+        return self.nreq > 0 and self.state == _Conn.HEAD and not self.buf
+
+    def send(self, data):
+        """Queue data for the client: written now as far as the socket takes it, the rest from _http_poll."""
+        mv = memoryview(data)
+        n = len(mv)
+        if not n:
+            return 0
+        if not self.status and n >= 12 and mv[0] == 72:  # "HTTP/1.1 NNN"
+            try:
+                self.status = int(bytes(mv[9:12]))
+                metrics.http_count(_metrics_route(self.path), self.status)
+            except:
+                pass
+        if not self.out and self.pull is None:
+            try:
+                sent = self.sock.send(mv)
+            except OSError as e:
+                if e.args[0] not in _EAGAIN:
+                    raise
+                sent = 0
+            if sent >= n:
+                return n
+            mv = mv[sent:]
+        if self.out_bytes + len(mv) > HTTP_OUT_MAX:
+            HTTP_STATS["out_overflow"] += 1
+            raise OSError(errno.ENOBUFS)
+        if not self.out:
+            self.t_write = now_ms()
+        self.out.append(mv)
+        self.out_bytes += len(mv)
+        self._watch(select.POLLOUT)
+        return n
+
+    def send_iter(self, pieces):
+        """Stream an iterable of byte pieces, pulled only as the socket drains."""
+        self.pull = iter(pieces)
+        self.t_write = now_ms()
+        self.flush()
+
+    def flush(self):
+        """Write queued output until the socket would block. True when all of it is out."""
+        while True:
+            if not self.out:
+                if self.pull is None:
+                    break
+                try:
+                    piece = next(self.pull)
+                except StopIteration:
+                    self.pull = None
+                    break
+                if piece:
+                    self.out.append(memoryview(piece))
+                    self.out_bytes += len(piece)
+                continue
 
+            mv = self.out[0]
+            try:
+                sent = self.sock.send(mv)
+            except OSError as e:
+                if e.args[0] not in _EAGAIN:
+                    raise
+                sent = 0
+            if not sent:
+                break
+            self.t_write = now_ms()
+            self.out_bytes -= sent
+            if sent < len(mv):
+                self.out[0] = mv[sent:]
+                break
+            self.out.pop(0)
 
-def _sse_event(event_id, fw, uid_hex, access, uids=None, ok=None, msg=None, src=None, cards=None, name=None):
-    if uids is None:
-        uids = []
-    if cards is None:
-        cards = []
-    payload = {"id": event_id, "fw": fw, "uid": uid_hex, "access": access, "uids": uids, "cards": cards}
-    if name is not None:
-        payload["name"] = name
-    if src is not None:
-        payload["src"] = src
-    if ok is not None:
-        payload["ok"] = bool(ok)
-    if msg is not None:
-        payload["msg"] = msg
-    return "event: update\ndata: {}\n\n".format(ujson.dumps(payload))
+        if self.out or self.pull is not None:
+            self._watch(select.POLLOUT)
+            return False
+        self._watch(select.POLLIN)
+        return True
 
+    def pending(self):
+        return bool(self.out) or self.pull is not None
 
-def _check_admin_token(headers, body):
-    """
-    Check for admin token in:
-    1. Authorization header: "Bearer <token>"
-    2. X-Admin-Token header: "<token>"
-    3. JSON body: {"token": "<token>"}
-    Returns True if valid, False otherwise.
-    """
-    if not ADMIN_TOKEN:
-        return True  # No token configured = no auth required
-    
-    # Check Authorization header
-    auth = headers.get("authorization", "")
-    if auth.startswith("Bearer ") and auth[7:] == ADMIN_TOKEN:
-        return True
-    
-    # Check X-Admin-Token header
-    if headers.get("x-admin-token", "") == ADMIN_TOKEN:
-        return True
-    
-    # Check JSON body
-    try:
-        if body:
-            data = ujson.loads(body.decode() if isinstance(body, bytes) else body)
-            if data.get("token") == ADMIN_TOKEN:
-                return True
-    except:
-        pass
-    
-    return False
+    def finish(self):
+        """Response done and no more requests on this socket: close after the output drains."""
+        if self.pending():
+            self.closing = True
+        else:
+            self.close()
 
+    def _watch(self, events):
+        if events != self.events and self.sock in _CONNS:
+            try:
+                _POLLER.modify(self.sock, events)
+                self.events = events
+            except:
+                pass
 
-def _check_basic_auth(headers):
-    """
-    Check HTTP Basic Auth credentials.
+    def close(self):
+        global SSE_CLIENT
+        if SSE_CLIENT is self:
+            SSE_CLIENT = None
+        if self.sink is not None:
+            sink = self.sink
+            self.sink = None
+            try:
+                sink.abort()  # body cut short
+            except:
+                pass
+        self.out = []
+        self.out_bytes = 0
+        self.pull = None
+        try:
+            _POLLER.unregister(self.sock)
+        except:
+            pass
+        try:
+            del _CONNS[self.sock]
+        except:
+            pass
+        try:
+            self.sock.close()
+        except:
+            pass
+
+
+def _http_reject(c, status):
+    _http_send(c, status=status, body=status.split(" ", 1)[1])
+    c.finish()
+
+
+def _http_on_readable(c):
+    try:
+        data = c.sock.recv(1024)
+    except OSError as e:
+        if e.args[0] in _EAGAIN:
+            return
+        if DEBUG_ERRORS and e.args[0] != 104:
+            log_err("HTTP", "read error:", e)
+        c.close()
+        return
+
+    if not data:
+        c.close()
+        return
+    if c.state == _Conn.STREAM:
+        return  # SSE clients have nothing to say
+    _http_process(c, data)
+
+
+def _http_on_writable(c):
+    try:
+        done = c.flush()
+    except Exception as e:
+        if DEBUG_ERRORS:
+            log_err("HTTP", "write error:", e)
+        c.close()
+        return
+    if not done:
+        return
+    if c.closing:
+        c.close()
+    elif c.rest and c.state == _Conn.HEAD:
+        data = c.rest
+        c.rest = b""
+        _http_process(c, data)
+
+
+def _http_sink(c, data):
+    """Feed body bytes to the handler's sink (SINK). True once the body is complete and answered."""
+    c.t_read = now_ms()
+    n = min(len(data), c.got)
+    if n:
+        c.got -= n
+        c.sink.feed(data[:n] if n < len(data) else data)
+    if c.got > 0:
+        return False
+    c.rest = data[n:]
+    sink = c.sink
+    c.sink = None
+    c.state = _Conn.DONE
+    sink.done()
+    return True
+
+
+def _http_process(c, data):
+    """Parse received bytes and serve every complete request in them."""
+    while True:
+        if c.state == _Conn.SINK:
+            try:
+                if not _http_sink(c, data):
+                    return
+            except Exception as e:
+                log_err("HTTP", "body sink error:", e)
+                c.close()
+                return
+        else:
+            if c.state == _Conn.HEAD and not c.buf and not _rate_take(c.ip):
+                HTTP_STATS["rate_limited"] += 1
+                _http_fast_reply(c.sock, _FAST_429, 429)
+                c.close()
+                return
+            try:
+                ready = c.feed(data)
+            except ValueError as e:
+                _http_reject(c, str(e))
+                return
+            if not ready:
+                return
+
+            c.keepalive = _http_keepalive_ok(c)
+            if c.nreq:
+                HTTP_STATS["keepalive_reused"] += 1
+            streamed = c.body is None
+            if streamed:
+                # HTTP_STREAM_BODY: the body is still (partly) on the wire. A reply
+                # sent without taking it (auth, bad args) has to close the socket.
+                req = Request(c, c.method, c.path, c.headers, b"")
+                ka = c.keepalive
+                if len(c.buf) < c.got:
+                    c.keepalive = False
+            else:
+                req = Request(c, c.method, c.path, c.headers, bytes(c.body))
+            c.body = None
+            _dispatch(req)
+
+            if req.keep:
+                c.state = _Conn.STREAM
+                return
+            if streamed:
+                data = c.buf
+                c.buf = b""
+                if req.sink is not None:
+                    # Body goes to the sink as it arrives; the sink replies when it is complete
+                    c.keepalive = ka
+                    c.sink = req.sink
+                    c.state = _Conn.SINK
+                    c.t0 = now_ms()
+                    continue
+                c.rest = data[c.got:]
+
+        if not c.keepalive:
+            c.finish()
+            return
+        data = c.reset()
+        if c.pending():
+            c.rest = data  # served once this response is out (_http_on_writable)
+            return
+        if not data:
+            return
+
+
+def _rate_take(ip):
+    """Token bucket per client IP. False = over the limit."""
+    if not HTTP_RATE_PER_S:
+        return True
+    now = now_ms()
+    b = _RATE.get(ip)
+    if b is None:
+        if len(_RATE) >= HTTP_RATE_CLIENTS:
+            old = None
+            for k, v in _RATE.items():
+                if old is None or ms_diff(v[1], _RATE[old][1]) < 0:
+                    old = k
+            del _RATE[old]
+        b = [HTTP_RATE_BURST * 1000, now]
+        _RATE[ip] = b
+    else:
+        b[0] = min(HTTP_RATE_BURST * 1000, b[0] + ms_diff(now, b[1]) * HTTP_RATE_PER_S)
+        b[1] = now
+    if b[0] < 1000:
+        return False
+    b[0] -= 1000
+    return True
+
+
+def _http_fast_reply(sock, reply, code):
+    # best effort, one non-blocking send; the caller closes the socket.
+    # Request is not parsed here, so these count under route "other".
+    metrics.http_count("other", code)
+    try:
+        sock.send(reply)
+    except:
+        pass
+
+
+def _http_keepalive_ok(c):
+    """HTTP/1.1 persistent connection, within the per-socket and global caps."""
+    conn = c.headers.get("connection", "").lower()
+    if "close" in conn:
+        return False
+    if c.version != "HTTP/1.1" and "keep-alive" not in conn:
+        return False
+    if c.nreq + 1 >= HTTP_KEEPALIVE_MAX_REQ:
+        return False
+    kept = 0
+    for x in _CONNS.values():
+        if x is not c and x.nreq and x.state != _Conn.STREAM:
+            kept += 1
+    return kept < HTTP_KEEPALIVE_MAX
+
+
+def _http_accept_drain(srv):
+    """Accept every pending connection, bounded by HTTP_MAX_CONNS and HTTP_ACCEPT_BUDGET_MS."""
+    global _accept_pending_since
+    t0 = now_ms()
+    since = _accept_pending_since or _last_poll_ms or t0
+    while True:
+        if len(_CONNS) >= HTTP_MAX_CONNS:
+            _http_evict_idle()
+        if len(_CONNS) >= HTTP_MAX_CONNS and ms_diff(now_ms(), since) >= HTTP_SHED_AFTER_MS:
+            # Still full after waiting: answer the queue with 503 instead of letting it grow
+            if ms_diff(now_ms(), t0) >= HTTP_ACCEPT_BUDGET_MS:
+                return
+            try:
+                cl, addr = srv.accept()
+            except OSError:
+                _accept_pending_since = 0
+                return
+            HTTP_STATS["shed"] += 1
+            cl.setblocking(False)
+            _http_fast_reply(cl, _FAST_503, 503)
+            cl.close()
+            continue
+        if len(_CONNS) >= HTTP_MAX_CONNS or ms_diff(now_ms(), t0) >= HTTP_ACCEPT_BUDGET_MS or _http_over_budget():
+            if not _accept_pending_since:
+                _accept_pending_since = since
+            HTTP_STATS["deferred"] += 1
+            return
+        try:
+            cl, addr = srv.accept()
+        except OSError:
+            _accept_pending_since = 0
+            return
+
+        wait = max(0, ms_diff(now_ms(), since))
+        HTTP_STATS["accepted"] += 1
+        HTTP_STATS["accept_wait_last_ms"] = wait
+        HTTP_STATS["accept_wait_sum_ms"] += wait
+        if wait > HTTP_STATS["accept_wait_max_ms"]:
+            HTTP_STATS["accept_wait_max_ms"] = wait
+
+        cl.setblocking(False)
+        c = _Conn(cl, addr)
+        _CONNS[cl] = c
+        _POLLER.register(cl, select.POLLIN)
+        # Browsers send the request right after connecting: try it now
+        # instead of waiting for the next poll round.
+        _http_on_readable(c)
+
+
+def _http_evict_idle():
+    """Close the longest-idle kept-alive socket to make room for a new client."""
+    old = None
+    for c in _CONNS.values():
+        if c.idle() and (old is None or ms_diff(c.t0, old.t0) < 0):
+            old = c
+    if old is not None:
+        old.close()
+        HTTP_STATS["keepalive_evicted"] += 1
+
+
+def _http_over_budget():
+    # checked between units of work; one slow handler can still overrun it
+    return ms_diff(now_ms(), _http_deadline) >= 0
+
+
+def _http_loop_begin():
+    """Main loop calls this once per iteration: new HTTP_LOOP_BUDGET_MS."""
+    global _http_spent_ms
+    if _http_spent_ms > HTTP_STATS["budget_spent_max_ms"]:
+        HTTP_STATS["budget_spent_max_ms"] = _http_spent_ms
+    _http_spent_ms = 0
+
+
+def _http_poll(srv, timeout_ms=0):
+    """
+    Service ready sockets once; never blocks longer than timeout_ms.
+    Stops when this loop iteration's HTTP_LOOP_BUDGET_MS is used up:
+    poll is level-triggered, so the rest is picked up next iteration.
+    """
+    global _last_poll_ms, _http_spent_ms
+    if _http_spent_ms >= HTTP_LOOP_BUDGET_MS:
+        if timeout_ms:
+            time.sleep_ms(timeout_ms)
+        return
+    global _http_deadline
+    evs = _POLLER.poll(timeout_ms)
+    t0 = now_ms()
+    _http_deadline = time.ticks_add(t0, HTTP_LOOP_BUDGET_MS - _http_spent_ms)
+    for n, ev in enumerate(evs):
+        if _http_over_budget():
+            HTTP_STATS["budget_deferred"] += len(evs) - n
+            break
+        obj, flags = ev[0], ev[1]
+        if obj is srv:
+            with trace("http.accept"):
+                _http_accept_drain(srv)
+            continue
+
+        c = _CONNS.get(obj)
+        if c is None:
+            try:
+                _POLLER.unregister(obj)
+            except:
+                pass
+            continue
+        if flags & select.POLLOUT:
+            with trace("http.write"):
+                _http_on_writable(c)
+            if _CONNS.get(obj) is not c:
+                continue  # closed after its last byte
+        if flags & select.POLLIN:
+            with trace("http.read"):
+                _http_on_readable(c)
+        elif flags & (select.POLLHUP | select.POLLERR):
+            c.close()
+
+    # Drop clients that never finished their request, and idle kept-alive ones
+    t = now_ms()
+    _last_poll_ms = t
+    if _CONNS:
+        for c in list(_CONNS.values()):
+            if c.pending():
+                if ms_diff(t, c.t_write) > HTTP_SEND_TIMEOUT_MS:
+                    HTTP_STATS["send_timeouts"] += 1
+                    c.close()
+                continue
+            if c.closing:
+                c.close()
+                continue
+            if c.state == _Conn.STREAM:
+                continue
+            if c.state == _Conn.SINK:
+                if ms_diff(t, c.t0) > HTTP_STREAM_TIMEOUT_MS or ms_diff(t, c.t_read) > HTTP_REQ_TIMEOUT_MS:
+                    log_warn("HTTP", "body upload timed out:", c.path)
+                    c.close()
+                continue
+            limit = HTTP_KEEPALIVE_IDLE_MS if c.idle() else HTTP_REQ_TIMEOUT_MS
+            if ms_diff(t, c.t0) > limit:
+                c.close()
+    _http_spent_ms += ms_diff(now_ms(), t0)
+
+
+def _http_close_all():
+    for c in list(_CONNS.values()):
+        c.close()
+
+
+class Request:
+    """
+    One parsed HTTP request. Query string, cookies and the JSON body are
+    split/parsed lazily and at most once, so auth middleware and the
+    handler share the same result.
+    """
+
+    def __init__(self, cl, method, path, headers, body):
+        self.cl = cl
+        self.method = method
+        q = path.find("?")
+        self.path = path if q < 0 else path[:q]
+        self.query = "" if q < 0 else path[q + 1:]
+        self.headers = headers
+        self.body = body
+        self.keep = False  # handler kept the socket (SSE), router must not close it
+        self.sink = None    # HTTP_STREAM_BODY routes: handler sets a body consumer (body is b"")
+        self._args = None
+        self._cookies = None
+        self._json = False  # False = not parsed yet, None = malformed
+
+    def cookies(self):
+        if self._cookies is None:
+            self._cookies = _parse_cookies(self.headers)
+        return self._cookies
+
+    def arg(self, name, default=""):
+        """Query string parameter (plain tokens, no %-decoding)."""
+        if self._args is None:
+            self._args = {}
+            for part in self.query.split("&"):
+                if part:
+                    k, _, v = part.partition("=")
+                    self._args[k] = v
+        return self._args.get(name, default)
+
+    def json(self):
+        """Body as dict ({} if empty), or None if it is not a JSON object."""
+        if self._json is False:
+            try:
+                j = ujson.loads(self.body.decode() if self.body else "{}")
+                self._json = j if isinstance(j, dict) else None
+            except:
+                self._json = None
+        return self._json
+
+
+def _http_send(cl, status="200 OK", ctype="text/plain; charset=utf-8", body="", extra=""):
+    # extra: additional header lines, each ending with \r\n
+    try:
+        body_b = body.encode() if isinstance(body, str) else body
+        hdr = "HTTP/1.1 {}\r\nContent-Type: {}\r\nContent-Length: {}\r\n{}{}\r\n".format(
+            status, ctype, len(body_b), extra, _conn_hdr(cl)
+        ).encode()
+        if len(body_b) > 512:
+            cl.send(hdr)  # don't copy big bodies just to prepend the header
+            if len(body_b) > HTTP_OUT_MAX // 2:
+                cl.send_iter((body_b,))  # queued by reference, beyond the copy cap
+            else:
+                cl.send(body_b)
+        else:
+            cl.send(hdr + body_b)
+    except:
+        _send_failed(cl)
+
+
+def _coalesced(chunks, coalesce):
+    # Small pieces are coalesced up to `coalesce` bytes; big ones go out
+    # as-is (no copy), so peak RAM is bounded by the largest single piece.
+    buf = bytearray()
+    for c in chunks:
+        if not c:
+            continue
+        if len(c) >= coalesce:
+            if buf:
+                yield buf
+                buf = bytearray()
+            yield c
+            continue
+        buf.extend(c)
+        if len(buf) >= coalesce:
+            yield buf
+            buf = bytearray()
+    if buf:
+        yield buf
+
+
+def _chunked_frames(chunks, coalesce):
+    for c in _coalesced(chunks, coalesce):
+        yield "{:x}\r\n".format(len(c)).encode()
+        yield c
+        yield b"\r\n"
+    yield b"0\r\n\r\n"
+
+
+def _send_chunked(cl, status="200 OK", ctype="text/plain; charset=utf-8", chunks=(), extra="", coalesce=512):
+    """
+    Stream an iterable of byte chunks with Transfer-Encoding: chunked.
+    The chunks are pulled by the connection's writer as the client reads,
+    so a slow client holds at most one piece in RAM and never the loop.
+    HTTP/1.0 clients get a plain body that ends when the socket closes.
+    """
+    framed = getattr(cl, "version", "HTTP/1.1") == "HTTP/1.1"
+    try:
+        if not framed:
+            cl.keepalive = False  # the close marks the end of the body
+        cl.send("HTTP/1.1 {}\r\nContent-Type: {}\r\n{}{}{}\r\n".format(
+            status, ctype, "Transfer-Encoding: chunked\r\n" if framed else "", extra, _conn_hdr(cl)
+        ).encode())
+        cl.send_iter(_chunked_frames(chunks, coalesce) if framed else _coalesced(chunks, coalesce))
+    except Exception as e:
+        _send_failed(cl)
+        if DEBUG_ERRORS:
+            log_err("HTTP", "chunked send error:", e)
+
+
+def _http_not_modified(cl, extra=""):
+    try:
+        cl.send("HTTP/1.1 304 Not Modified\r\n{}{}\r\n".format(extra, _conn_hdr(cl)).encode())
+    except:
+        _send_failed(cl)
+
+
+def _send_page(req, name):
+    """Static UI page: gzip if the client accepts it, strong ETag, 304 on If-None-Match."""
+    raw, gz, etag = ui_html.asset(name)
+    use_gz = gz is not None and "gzip" in req.headers.get("accept-encoding", "")
+    tag = '"{}{}"'.format(etag, "-gz" if use_gz else "")
+    extra = "ETag: {}\r\nCache-Control: no-cache\r\nVary: Accept-Encoding\r\n".format(tag)
+
+    if tag in req.headers.get("if-none-match", ""):
+        _http_not_modified(req.cl, extra)
+        return
+    if use_gz:
+        extra += "Content-Encoding: gzip\r\n"
+    _http_send(req.cl, status="200 OK", ctype="text/html; charset=utf-8", body=gz if use_gz else raw, extra=extra)
+
+
+def _json_response(cl, obj, status="200 OK", extra=""):
+    _http_send(cl, status=status, ctype="application/json", body=ujson.dumps(obj), extra=extra)
+
+
+def _db_etag(suffix=""):
+    """Strong ETag of card DB state: same tag = same cards (for the same request)."""
+    return '"db{:x}-{}{}"'.format(_DB_EPOCH, DB_VERSION, suffix)
+
+
+def _etag_headers(etag):
+    return "ETag: {}\r\nCache-Control: no-cache\r\n".format(etag)
+
+
+def _not_modified(req, etag):
+    """Send 304 and return True if If-None-Match already names etag."""
+    inm = req.headers.get("if-none-match", "")
+    if inm and (etag in inm or inm.strip() == "*"):
+        _http_not_modified(req.cl, _etag_headers(etag))
+        return True
+    return False
+
+
+def _wants_minimal(req):
+    # "Prefer: return=minimal" header (RFC 7240) or {"minimal": true} in the body
+    if "return=minimal" in req.headers.get("prefer", ""):
+        return True
+    j = req.json()
+    return bool(j and j.get("minimal"))
+
+
+def _sse_headers():
+    return (
+        "HTTP/1.1 200 OK\r\n"
+        "Content-Type: text/event-stream\r\n"
+        "Cache-Control: no-cache\r\n"
+        "Connection: keep-alive\r\n\r\n"
+    )
+
+
+def _sse_event(event_id, fw, uid_hex, access, ok=None, msg=None, src=None, name=None):
+    # Card list is not included (it can be large): changes arrive as "cards"
+    # deltas; a "version" the client has not seen means it missed one.
+    payload = {"id": event_id, "fw": fw, "uid": uid_hex, "access": access, "version": DB_VERSION}
+    if name is not None:
+        payload["name"] = name
+    if src is not None:
+        payload["src"] = src
+    if ok is not None:
+        payload["ok"] = bool(ok)
+    if msg is not None:
+        payload["msg"] = msg
+    return "event: update\ndata: {}\n\n".format(ujson.dumps(payload))
+
+
+def _sse_presence_event():
+    payload = {"present": bool(CARD_PRESENT_HEX), "uid": CARD_PRESENT_HEX}
+    return "event: presence\ndata: {}\n\n".format(ujson.dumps(payload))
+
+
+def _sse_cards_event():
+    # Card list delta: clients whose list is at "base" apply "ops" by UID,
+    # anyone else (or "reset") reloads the visible page.
+    payload = {"version": DB_VERSION, "base": _DB_DELTA_BASE}
+    if _DB_DELTA_RESET:
+        payload["reset"] = True
+    else:
+        payload["ops"] = _DB_DELTAS
+    return "event: cards\ndata: {}\n\n".format(ujson.dumps(payload))
+
+
+def _check_admin_token(req):
+    """
+    Check for admin token in:
+    1. Authorization header: "Bearer <token>"
+    2. X-Admin-Token header: "<token>"
+    3. JSON body: {"token": "<token>"}
+    Returns True if valid, False otherwise.
+    """
+    if not ADMIN_TOKEN:
+        return True  # No token configured = no auth required
+    
+    # Check Authorization header
+    auth = req.headers.get("authorization", "")
+    if auth.startswith("Bearer ") and auth[7:] == ADMIN_TOKEN:
+        return True
+    
+    # Check X-Admin-Token header
+    if req.headers.get("x-admin-token", "") == ADMIN_TOKEN:
+        return True
+    
+    # Check JSON body (parsed once, shared with the handler)
+    data = req.json()
+    if data and data.get("token") == ADMIN_TOKEN:
+        return True
+    
+    return False
+
+
+def _check_basic_auth(headers):
+    """
+    Check HTTP Basic Auth credentials.
     Returns True if auth is disabled or credentials are valid, False otherwise.
     """
     if not UI_AUTH_ENABLED or not UI_USER or not UI_PASS:
@@ -656,25 +2154,29 @@ def _unauth(cl):
             "WWW-Authenticate: Basic realm=\"ESP32 NFC Panel\"\r\n"
             "Content-Type: text/plain; charset=utf-8\r\n"
             "Content-Length: 12\r\n"
-            "Connection: close\r\n\r\n"
+            "{}\r\n"
             "Unauthorized"
-        )
+        ).format(_conn_hdr(cl))
         cl.send(hdr.encode())
     except:
-        pass
+        _send_failed(cl)
 
 
 # -----------------------
 # WEB SERVER + PORTAL
 # -----------------------
 def _start_web_server():
+    global _last_poll_ms, _accept_pending_since
     addr = socket.getaddrinfo("0.0.0.0", 80)[0][-1]
     s = socket.socket()
     s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     s.bind(addr)
-    s.listen(2)
+    s.listen(HTTP_BACKLOG)
     s.setblocking(False)
-    log("PORT80", "listening on :80")
+    _POLLER.register(s, select.POLLIN)
+    _last_poll_ms = 0
+    _accept_pending_since = 0
+    log("PORT80", "listening on :80 backlog={} max_conns={}".format(HTTP_BACKLOG, HTTP_MAX_CONNS))
     return s
 
 
@@ -689,26 +2191,30 @@ def _sta_mode_restore():
 def _enter_wifi_setup_and_return(srv, sse_client):
     if LOG_PORTAL:
         log("PORTAL", "enter provisioning (closing app server)")
+    access_log_flush()
+    card_stats_flush()
+    logsink.flush()  # the portal prints directly
 
     if srv:
+        try:
+            _POLLER.unregister(srv)
+        except:
+            pass
         try:
             srv.close()
         except:
             pass
         srv = None
 
-    try:
-        if sse_client:
-            sse_client.close()
-    except:
-        pass
+    # closes the SSE client too
+    _http_close_all()
     sse_client = None
 
     op_t0 = time.ticks_ms()
     try:
-        wifi_prov.provisioning_portal(loop_forever=False)
+        wifi_prov.provisioning_portal(loop_forever=False, on_idle=_wdt_feed)
     except Exception as e:
-        log("PORTAL", "error:", e)
+        log_err("PORTAL", "error:", e)
     op_dt = op_ms(op_t0)
     op_log("PORTAL_SESSION", op_dt)
 
@@ -721,7 +2227,7 @@ def _enter_wifi_setup_and_return(srv, sse_client):
     try:
         srv = _start_web_server()
     except Exception as e:
-        log("PORT80", "cannot start app server:", e)
+        log_err("PORT80", "cannot start app server:", e)
         srv = None
 
     return srv, sse_client
@@ -736,14 +2242,864 @@ except Exception as e:
     log("TG", "disabled (tg_esp import failed):", e)
 
 
+# -----------------------
+# SSE + TELEGRAM COMMANDS
+# -----------------------
+def _sse_send(text):
+    """Write one event to the live /events client (drops it on error)."""
+    global SSE_CLIENT
+    if not SSE_CLIENT:
+        return
+    try:
+        with trace("sse.send"):
+            SSE_CLIENT.send(text.encode())
+    except:
+        try:
+            SSE_CLIENT.close()
+        except:
+            pass
+        SSE_CLIENT = None
+        log("SSE", "client disconnected")
+
+
+def _sse_flush_deltas():
+    """Push queued card changes as one "cards" event."""
+    global _DB_DELTA_RESET
+    if not _DB_DELTAS and not _DB_DELTA_RESET:
+        return
+    _sse_send(_sse_cards_event())
+    del _DB_DELTAS[:]
+    _DB_DELTA_RESET = False
+
+
+def _sse_broadcast(**kw):
+    """Send an update event (card deltas first, so "version" is already known)."""
+    _sse_flush_deltas()
+    _sse_send(_sse_event(
+        EVENT_ID, LAST_FW, LAST_UID_HEX, LAST_ACCESS, name=LAST_NAME, **kw
+    ))
+
+
+def _card_presence(hx):
+    """Card arrived (hx) or was removed ("") from the reader."""
+    global CARD_PRESENT_HEX
+    if hx == CARD_PRESENT_HEX:
+        return
+    if not hx:
+        metrics.C[metrics.NFC_REMOVALS] += 1
+        log("NFC", "removed", CARD_PRESENT_HEX)
+    CARD_PRESENT_HEX = hx
+    _sse_send(_sse_presence_event())
+
+
+def _card_stats_text(n=5):
+    cards, never, denied = card_stats_report("top", n)
+    lines = ["Cards: {} (never used: {})".format(len(UIDS_SORTED), never), "Most used:"]
+    for hx, taps, last in cards:
+        if taps:
+            lines.append("  {} {} x{}".format(hx, UID_NAME_BY_HEX.get(hx, "") or "-", taps))
+    stale, _, _ = card_stats_report("stale", n)
+    lines.append("Least recently used:")
+    for hx, taps, last in stale:
+        lines.append("  {} {} {}".format(hx, UID_NAME_BY_HEX.get(hx, "") or "-", "never" if not last else "x{}".format(taps)))
+    if denied:
+        lines.append("Unknown cards denied:")
+        for hx, attempts, last in denied[:n]:
+            lines.append("  {} x{}".format(hx, attempts))
+    return "\n".join(lines)
+
+
+def _tg_handle_cmd(text: str):
+    global EVENT_ID
+
+    t = (text or "").strip()
+    if t in ("/start", "/help"):
+        return "ESP32 NFC bot\n/last\n/add_last\n/stats\n/help"
+
+    if t == "/stats":
+        return _card_stats_text()
+
+    if t == "/last":
+        return "LAST UID: {}\nName: {}\nAccess: {}".format(
+            LAST_UID_HEX or "-", LAST_NAME or "-", LAST_ACCESS or "-"
+        )
+
+    if t == "/add_last":
+        if not LAST_UID_HEX:
+            return "No LAST UID (tap a card first)"
+
+        ok, msg = uids_add(LAST_UID_HEX)
+
+        if ok and LED is not None:
+            blink(LED, times=2, on_ms=90, off_ms=60, color=(60, 35, 0))
+
+        EVENT_ID += 1
+        _sse_broadcast(ok=ok, msg=msg, src="tg")
+
+        return ("OK: " if ok else "ERR: ") + msg
+
+    return None
+
+
+# -----------------------
+# HTTP ROUTES
+# -----------------------
+# Handlers take a Request and write the response to req.cl. Afterwards the
+# socket is closed or kept alive for the next request, unless the handler
+# took it over (SSE) by setting req.keep.
+def _h_login_page(req):
+    _send_page(req, "login")
+
+
+def _h_login(req):
+    data = req.json()
+    if data is None:
+        _json_response(req.cl, {"ok": False, "msg": "Login error"}, status="400 Bad Request")
+        return
+
+    username = data.get("username", "")
+    password = data.get("password", "")
+    if username == UI_USER and password == UI_PASS:
+        _set_cookie_redirect(req.cl, "/", _create_session())
+        log("AUTH", "Login successful for user:", username)
+    else:
+        _json_response(req.cl, {"ok": False, "msg": "Invalid credentials"}, status="401 Unauthorized")
+        log_warn("AUTH", "Login failed for user:", username)
+
+
+def _h_logout(req):
+    _destroy_session(req)
+    _clear_cookie_redirect(req.cl, "/login")
+    log("AUTH", "Logout")
+
+
+def _h_index(req):
+    if "gzip" in req.headers.get("accept-encoding", ""):
+        _send_page(req, "index")
+        return
+
+    # No gzip: stream a server-rendered page instead. Card rows (first
+    # page) are generated one at a time while sending.
+    names = UID_NAME_BY_HEX
+    _send_chunked(
+        req.cl,
+        ctype="text/html; charset=utf-8",
+        chunks=ui_html.render(ui_html.template("index"), {
+            "fw": str(LAST_FW or ""),
+            "uid": LAST_UID_HEX,
+            "name": LAST_NAME,
+            "acc": ui_html.access_pill(LAST_ACCESS),
+            "uids": ui_html.card_rows((hx, names.get(hx, "")) for hx in UIDS_SORTED[:UIDS_PAGE_DEFAULT]),
+        }),
+        extra="Cache-Control: no-store\r\n"
+    )
+
+
+def _h_bootstrap(req):
+    # Dynamic part of the dashboard (the page itself is a static shell).
+    # Also depends on the last tap, hence EVENT_ID in the tag.
+    etag = _db_etag("-{}".format(EVENT_ID))
+    if _not_modified(req, etag):
+        return
+    cards, nxt = uids_page()
+    _json_response(req.cl, {
+        "ok": True,
+        "id": EVENT_ID,
+        "fw": LAST_FW,
+        "uid": LAST_UID_HEX,
+        "access": LAST_ACCESS,
+        "name": LAST_NAME,
+        "cards": cards,
+        "next": nxt,
+        "total": len(UIDS_SORTED),
+        "version": DB_VERSION
+    }, extra=_etag_headers(etag))
+
+
+def _h_events(req):
+    global SSE_CLIENT
+    cl = req.cl
+    cl.send(_sse_headers().encode())
+    cl.send(_sse_event(
+        EVENT_ID, LAST_FW, LAST_UID_HEX, LAST_ACCESS, src="init", name=LAST_NAME
+    ).encode())
+    cl.send(_sse_presence_event().encode())
+    try:
+        if SSE_CLIENT:
+            SSE_CLIENT.close()
+    except:
+        pass
+    SSE_CLIENT = cl
+    req.keep = True
+    log("SSE", "client connected")
+
+
+def _uids_reply(req, ok, msg):
+    if _wants_minimal(req):
+        _json_response(req.cl, {"ok": bool(ok), "msg": msg, "version": DB_VERSION})
+        return
+    # First page only: response size is bounded by UIDS_PAGE_DEFAULT, not the DB size
+    cards, nxt = uids_page()
+    _json_response(req.cl, {
+        "ok": bool(ok),
+        "msg": msg,
+        "count": len(UIDS_SORTED),
+        "cards": cards,
+        "next": nxt,
+        "version": DB_VERSION
+    })
+
+
+def _h_uids_list(req):
+    # {"after": "<last uid of previous page>", "limit": 50, "q": "<uid or name prefix>"}
+    # Repeat the same request with If-None-Match: 304 while the DB is unchanged.
+    import ubinascii
+    j = req.json() or {}
+    after = j.get("after") or ""
+    limit = j.get("limit") or UIDS_PAGE_DEFAULT
+    q = j.get("q") or ""
+    # Tag is per page/search: a different after/limit/q must not match
+    key = "{}|{}|{}".format(after, limit, q).encode()
+    etag = _db_etag("-{:x}".format(ubinascii.crc32(key)))
+    if _not_modified(req, etag):
+        return
+    cards, nxt = uids_page(after, limit, q)
+    _json_response(req.cl, {
+        "ok": True,
+        "cards": cards,
+        "next": nxt,
+        "total": len(UIDS_SORTED),
+        "version": DB_VERSION
+    }, extra=_etag_headers(etag))
+
+
+def _h_uids_add_last(req):
+    if not LAST_UID_HEX:
+        ok = False
+        msg = "No LAST UID (tap a card first)"
+    else:
+        ok, msg = uids_add(LAST_UID_HEX)
+
+    if ok and LED is not None:
+        blink(LED, times=2, on_ms=90, off_ms=60, color=(60, 35, 0))
+    _uids_reply(req, ok, msg)
+
+
+def _h_uids_add(req):
+    j = req.json() or {}
+    ok, msg = uids_add(j.get("uid_hex", ""), j.get("name", ""))
+    _uids_reply(req, ok, msg)
+
+
+def _h_uids_remove(req):
+    j = req.json() or {}
+    ok, msg = uids_remove(j.get("uid_hex", ""))
+    _uids_reply(req, ok, msg)
+
+
+def _h_uids_set_name(req):
+    j = req.json() or {}
+    ok, msg = uids_set_name(j.get("uid_hex", ""), j.get("name", ""))
+    _uids_reply(req, ok, msg)
+
+
+def _h_uids_batch(req):
+    j = req.json() or {}
+    ops = j.get("ops")
+    if not isinstance(ops, list):
+        _json_response(req.cl, {"ok": False, "msg": "ops list required"}, status="400 Bad Request")
+        return
+    if len(ops) > UIDS_BATCH_MAX:
+        _json_response(req.cl, {"ok": False, "msg": "Too many ops (max {})".format(UIDS_BATCH_MAX)},
+                       status="413 Payload Too Large")
+        return
+
+    t0 = time.ticks_ms()
+    saved, results = uids_batch(ops)
+    applied = 0
+    for r in results:
+        if r["ok"]:
+            applied += 1
+    op_log("UIDS_BATCH", op_ms(t0), "ops={} ok={} saved={}".format(len(ops), applied, saved))
+    _json_response(req.cl, {
+        "ok": saved,
+        "msg": "Applied {}/{}".format(applied, len(ops)) if saved else "Save failed",
+        "results": results,
+        "count": len(UIDS_SORTED),
+        "version": DB_VERSION
+    })
+
+
+def _export_lines(fmt):
+    # Pulled while the main loop keeps running: walk by cursor, so cards
+    # added/removed meanwhile never make it skip or repeat one.
+    if fmt == "csv":
+        yield b"uid,name\n"
+    last = ""
+    while True:
+        i = _bisect_right(UIDS_SORTED, last) if last else 0
+        if i >= len(UIDS_SORTED):
+            break
+        last = UIDS_SORTED[i]
+        yield _card_line(last, UID_NAME_BY_HEX.get(last, ""), fmt).encode()
+
+
+def _h_uids_export(req):
+    # ?format=csv (default) | jsonl; streamed one card at a time
+    fmt = req.arg("format", "csv")
+    if fmt not in ("csv", "jsonl"):
+        _json_response(req.cl, {"ok": False, "msg": "format: csv or jsonl"}, status="400 Bad Request")
+        return
+    etag = _db_etag("-" + fmt)
+    if _not_modified(req, etag):
+        return
+    _send_chunked(
+        req.cl,
+        ctype="text/csv; charset=utf-8" if fmt == "csv" else "application/x-ndjson",
+        chunks=_export_lines(fmt),
+        extra='Content-Disposition: attachment; filename="uids.{}"\r\n{}'.format(fmt, _etag_headers(etag))
+    )
+
+
+_IMPORT_SINK = None  # running import (one at a time: it owns UIDS_IMPORT_FILE)
+
+
+class _ImportSink:
+    """
+    Body of POST /api/uids/import, parsed as it arrives (_Conn.SINK), a
+    socket read at a time from the main loop. Parsed cards go to
+    UIDS_IMPORT_FILE, not RAM; done() applies them in one pass and swaps
+    the new uids.json in with a rename. A cut upload or a failed save
+    leaves the DB and uids.json as they were, and taps during the upload
+    see the old list.
+    """
+
+    def __init__(self, cl, fmt, mode):
+        self.cl = cl
+        self.fmt = fmt
+        self.mode = mode
+        self.lines = _LineSplit()
+        self.f = open(UIDS_IMPORT_FILE, "w")
+        self.out = []    # staged lines not written yet
+        self.out_n = 0
+        self.n = 0       # non-blank lines
+        self.skipped = 0
+        self.err = None
+        self.t0 = time.ticks_ms()
+
+    def feed(self, data):
+        if self.err is not None:
+            return
+        try:
+            for line in self.lines.feed(data):
+                self._line(line)
+            if self.out_n >= 512:
+                self._write()
+        except Exception as e:
+            self.err = e
+
+    def _line(self, line):
+        s = line.strip()
+        if not s:
+            return
+        self.n += 1
+        if self.n == 1 and self.fmt == "csv" and s.split(b",", 1)[0].strip().lower() == b"uid":
+            return  # header
+        c = _parse_card_line(s, self.fmt)
+        b = uid_hex_to_bytes(c[0]) if c else None
+        if not b:
+            self.skipped += 1
+            return
+        ln = _card_line(uid_bytes_to_hex(b), c[1])
+        self.out.append(ln)
+        self.out_n += len(ln)
+
+    def _write(self):
+        self.f.write("".join(self.out))
+        self.out = []
+        self.out_n = 0
+
+    def _cleanup(self):
+        global _IMPORT_SINK
+        _IMPORT_SINK = None
+        import os
+        try:
+            self.f.close()
+        except:
+            pass
+        for p in (UIDS_IMPORT_FILE, UIDS_FILE + ".new"):
+            try:
+                os.remove(p)
+            except:
+                pass
+
+    def abort(self):
+        log_warn("UIDS", "import aborted: upload cut after", self.n, "lines")
+        self._cleanup()
+
+    def done(self):
+        tail = self.lines.tail()
+        if tail is not None:
+            self.feed(tail + b"\n")
+        try:
+            if self.err is not None:
+                raise self.err
+            self._write()
+            self.f.close()
+            added, updated = self._apply()
+        except Exception as e:
+            self._cleanup()
+            log_err("UIDS", "import aborted:", e)
+            _json_response(self.cl, {"ok": False, "msg": "Import aborted: {}".format(e)},
+                           status="400 Bad Request")
+            return
+        self._cleanup()
+        _db_touch()
+        op_log("UIDS_IMPORT", op_ms(self.t0), "{} {} added={} updated={} skipped={}".format(
+            self.fmt, self.mode, added, updated, self.skipped))
+        _json_response(self.cl, {
+            "ok": True,
+            "msg": "Imported",
+            "added": added,
+            "updated": updated,
+            "skipped": self.skipped,
+            "count": len(UIDS_SORTED),
+            "version": DB_VERSION
+        })
+
+    def _apply(self):
+        """Staged cards -> RAM DB -> uids.json.new -> renamed over uids.json. Rolls back on error."""
+        global ALLOWED_UIDS, UID_NAME_BY_HEX
+        import os
+        used = _card_stats_used()
+        added = 0
+        updated = 0
+        try:
+            if self.mode == "replace":
+                ALLOWED_UIDS = set()
+                UID_NAME_BY_HEX = {}
+            with open(UIDS_IMPORT_FILE, "rb") as f:
+                for line in _iter_lines(f.read):
+                    c = _parse_card_line(line)
+                    b = uid_hex_to_bytes(c[0]) if c else None
+                    if not b:
+                        continue
+                    hx = uid_bytes_to_hex(b)
+                    if b in ALLOWED_UIDS:
+                        if c[1] and UID_NAME_BY_HEX.get(hx) != c[1]:
+                            UID_NAME_BY_HEX[hx] = c[1]
+                            updated += 1
+                        continue
+                    ALLOWED_UIDS.add(b)
+                    UID_NAME_BY_HEX[hx] = c[1]
+                    added += 1
+            _sync_hex_set_from_bytes()  # one re-sort; usage stats carried over
+            if not _save_uids_file(UIDS_FILE + ".new"):
+                raise OSError("save failed")
+            try:
+                os.rename(UIDS_FILE + ".new", UIDS_FILE)
+            except OSError:
+                os.remove(UIDS_FILE)  # FAT does not rename over a file
+                os.rename(UIDS_FILE + ".new", UIDS_FILE)
+        except:
+            _load_uids_file_or_init()
+            _card_stats_rebuild(used)
+            raise
+        return added, updated
+
+
+def _h_uids_import(req):
+    # ?format=csv|jsonl &mode=merge (default) | replace
+    # Body is taken by _ImportSink as it arrives; all or nothing.
+    global _IMPORT_SINK
+    fmt = req.arg("format", "csv")
+    mode = req.arg("mode", "merge")
+    if fmt not in ("csv", "jsonl") or mode not in ("merge", "replace"):
+        _json_response(req.cl, {"ok": False, "msg": "format: csv|jsonl, mode: merge|replace"},
+                       status="400 Bad Request")
+        return
+    if _IMPORT_SINK is not None:
+        _json_response(req.cl, {"ok": False, "msg": "Another import is running"}, status="409 Conflict")
+        return
+    try:
+        _IMPORT_SINK = _ImportSink(req.cl, fmt, mode)
+    except Exception as e:
+        log_err("UIDS", "import staging error:", e)
+        _json_response(req.cl, {"ok": False, "msg": "Import staging failed"}, status="500 Internal Server Error")
+        return
+    req.sink = _IMPORT_SINK
+
+
+def _h_uids_clear(req):
+    ok = uids_clear_all()
+    _uids_reply(req, ok, "Cleared" if ok else "Clear failed")
+
+
+def _h_stats(req):
+    st = dict(HTTP_STATS)
+    st["open_conns"] = len(_CONNS)
+    st["accept_wait_avg_ms"] = (st["accept_wait_sum_ms"] // st["accepted"]) if st["accepted"] else 0
+    sess = dict(SESSION_STATS)
+    sess["active"] = len(SESSIONS)
+    sess["max"] = SESSION_MAX
+    taps = dict(TAP_FILTER_STATS)
+    taps["tracked"] = len(_TAP_TABLE)
+    _json_response(req.cl, {"ok": True, "http": st, "sessions": sess, "taps": taps})
+
+
+def _h_tap_latency(req):
+    # Per-stage tap latency since boot, microseconds
+    stages = {}
+    for st in TAP_STAGES:
+        stages[st] = TAP_LAT[st].summary()
+    _json_response(req.cl, {"ok": True, "unit": "us", "buckets_us": list(metrics.LAT_BUCKETS_US), "stages": stages})
+
+
+def _metrics_lines():
+    # Prometheus text format, one small piece at a time (pulled by the writer)
+    p = "nfcpanel_"
+    for piece in metrics.render_core(p):
+        yield piece
+
+    yield metrics.head(p + "nfc_taps_suppressed_total", "counter", "Reads skipped by the tap filter by reason")
+    for k in ("debounced", "rate_limited", "locked_out"):
+        yield metrics.line(p + "nfc_taps_suppressed_total", TAP_FILTER_STATS[k], 'reason="{}"'.format(k))
+    yield metrics.head(p + "loop_stalls_total", "counter", "Main loop iterations over LOOP_STALL_MS")
+    yield metrics.line(p + "loop_stalls_total", STALL_STATS["stalls"])
+    yield metrics.head(p + "http_open_sockets", "gauge", "Open client sockets (incl. SSE)")
+    yield metrics.line(p + "http_open_sockets", len(_CONNS))
+    yield metrics.head(p + "sse_clients", "gauge", "Connected /events clients")
+    yield metrics.line(p + "sse_clients", 1 if SSE_CLIENT else 0)
+    yield metrics.head(p + "sessions_active", "gauge", "UI sessions")
+    yield metrics.line(p + "sessions_active", len(SESSIONS))
+    yield metrics.head(p + "cards", "gauge", "Cards in the allow list")
+    yield metrics.line(p + "cards", len(UIDS_SORTED))
+    yield metrics.head(p + "http_events_total", "counter", "HTTP server events (see /api/stats)")
+    for k in ("accepted", "deferred", "keepalive_reused", "keepalive_evicted", "out_overflow",
+              "send_timeouts", "rate_limited", "shed", "budget_deferred"):
+        yield metrics.line(p + "http_events_total", HTTP_STATS[k], 'event="{}"'.format(k))
+
+    if tg_esp:
+        st = tg_esp.STATS
+        yield metrics.head(p + "telegram_sends_total", "counter", "Telegram sendMessage calls by result")
+        yield metrics.line(p + "telegram_sends_total", st["sent"], 'result="ok"')
+        yield metrics.line(p + "telegram_sends_total", st["send_failed"], 'result="failed"')
+        yield metrics.head(p + "telegram_polls_total", "counter", "Telegram getUpdates calls by result")
+        yield metrics.line(p + "telegram_polls_total", st["polls"] - st["poll_failed"], 'result="ok"')
+        yield metrics.line(p + "telegram_polls_total", st["poll_failed"], 'result="failed"')
+
+
+def _h_stalls(req):
+    # Worst main loop iterations since boot (see _loop_supervise)
+    _json_response(req.cl, {
+        "ok": True,
+        "stage": LOOP_STAGE,
+        "stall_ms": LOOP_STALL_MS,
+        "max_ms": metrics.loop_max_ms,
+        "stalls": STALL_STATS["stalls"],
+        "top": STALLS,
+        "wdt_ms": LOOP_WDT_MS if _WDT else 0,
+        "wdt_reset": STALL_STATS["wdt_reset"],
+        "wdt_stage": STALL_STATS["wdt_stage"],
+    })
+
+
+def _access_events_json(since, uid, limit):
+    yield b'{"ok":true,"events":['
+    sep = ""
+    last = -1
+    n = 0
+    for seq, t, hx, granted, reader in access_log_query(since, uid, limit):
+        yield '{}{{"seq":{},"t":{},"uid":"{}","name":{},"access":"{}","reader":{}}}'.format(
+            sep, seq, t, hx, ujson.dumps(UID_NAME_BY_HEX.get(hx, "")), "GRANTED" if granted else "DENIED", reader).encode()
+        sep = ","
+        last = seq
+        n += 1
+    nxt = (last + 1) if n >= limit else _alog_next
+    yield '],"next":{}}}'.format(nxt).encode()
+
+
+def _h_access_events(req):
+    # Access log from flash: ?since=<seq>&uid=<hex>&limit=<n>, streamed
+    try:
+        since = int(req.arg("since", "0") or 0)
+        limit = min(ACCESS_LOG_QUERY_MAX, int(req.arg("limit", "100") or 100))
+    except:
+        _json_response(req.cl, {"ok": False, "msg": "Bad since/limit"}, status="400 Bad Request")
+        return
+    uid = None
+    if req.arg("uid", ""):
+        uid = uid_hex_to_bytes(req.arg("uid").replace("+", " ").replace("%20", " "))
+        if not uid:
+            _json_response(req.cl, {"ok": False, "msg": "Bad UID format"}, status="400 Bad Request")
+            return
+    _send_chunked(req.cl, ctype="application/json", chunks=_access_events_json(since, uid, limit))
+
+
+def _h_card_stats(req):
+    # ?sort=stale (least recently used first, default) | top &limit=<n>
+    sort = req.arg("sort", "stale")
+    try:
+        limit = max(1, min(UIDS_PAGE_MAX, int(req.arg("limit", str(UIDS_PAGE_DEFAULT)))))
+    except:
+        limit = UIDS_PAGE_DEFAULT
+    cards, never, denied = card_stats_report(sort, limit)
+    _json_response(req.cl, {
+        "ok": True,
+        "now": int(time.time()),
+        "total": len(UIDS_SORTED),
+        "never_used": never,
+        "cards": [{"uid": hx, "name": UID_NAME_BY_HEX.get(hx, ""), "taps": taps, "last": last}
+                  for hx, taps, last in cards],
+        "denied_unknown": [{"uid": hx, "attempts": a, "last": last} for hx, a, last in denied],
+    })
+
+
+_LOG_LEVELS = {"debug": logsink.DEBUG, "info": logsink.INFO, "warn": logsink.WARN, "error": logsink.ERROR}
+
+
+def _h_logs(req):
+    # Recent log lines from the RAM ring: ?since=<seq>&level=<name>&limit=<n>
+    try:
+        since = int(req.arg("since", "0") or 0)
+        limit = int(req.arg("limit", str(logsink.RING_SIZE)) or logsink.RING_SIZE)
+    except:
+        _json_response(req.cl, {"ok": False, "msg": "Bad since/limit"}, status="400 Bad Request")
+        return
+    limit = max(1, min(logsink.RING_SIZE, limit))
+    level = _LOG_LEVELS.get(req.arg("level", "debug"), logsink.DEBUG)
+    out = []
+    for seq, age, lv, text in logsink.lines(since, level, limit):
+        out.append({"seq": seq, "age_ms": age, "level": logsink.LEVEL_NAMES.get(lv, lv), "msg": text})
+    _json_response(req.cl, {
+        "ok": True,
+        "lines": out,
+        "next": (out[-1]["seq"] + 1) if (out and len(out) >= limit) else logsink.next_seq(),
+        "dropped": logsink.STATS["dropped"],
+    })
+
+
+def _h_trace(req):
+    # Recorded spans as Chrome Trace Event JSON (chrome://tracing, ui.perfetto.dev)
+    _send_chunked(req.cl, ctype="application/json", chunks=tracing.chrome_json())
+
+
+def _h_trace_set(req):
+    data = req.json() or {}
+    tracing.enable(data.get("enabled", True))
+    _json_response(req.cl, {"ok": True, "enabled": tracing.ENABLED, "ring": tracing.RING_SIZE})
+
+
+def _h_metrics(req):
+    _send_chunked(req.cl, ctype="text/plain; version=0.0.4", chunks=_metrics_lines())
+
+
+# Auth levels (checked by the router before the handler runs)
+AUTH_NONE = 0
+AUTH_PAGE = 1      # UI session; browsers are redirected to /login
+AUTH_SESSION = 2   # UI session; 401 JSON
+AUTH_ADMIN = 3     # ADMIN_TOKEN (header or JSON body)
+
+# (method, path) -> (handler, auth)
+ROUTES = {
+    ("GET", "/login"): (_h_login_page, AUTH_NONE),
+    ("POST", "/login"): (_h_login, AUTH_NONE),
+    ("GET", "/logout"): (_h_logout, AUTH_NONE),
+    ("GET", "/"): (_h_index, AUTH_PAGE),
+    ("GET", "/api/bootstrap"): (_h_bootstrap, AUTH_SESSION),
+    ("GET", "/events"): (_h_events, AUTH_SESSION),
+    ("POST", "/api/uids/list"): (_h_uids_list, AUTH_SESSION),
+    ("GET", "/api/stats"): (_h_stats, AUTH_SESSION),
+    ("GET", "/api/tap_latency"): (_h_tap_latency, AUTH_SESSION),
+    ("GET", "/api/stalls"): (_h_stalls, AUTH_SESSION),
+    ("GET", "/metrics"): (_h_metrics, AUTH_ADMIN),
+    ("GET", "/api/events"): (_h_access_events, AUTH_SESSION),
+    ("GET", "/api/card_stats"): (_h_card_stats, AUTH_SESSION),
+    ("GET", "/api/logs"): (_h_logs, AUTH_ADMIN),
+    ("GET", "/api/trace"): (_h_trace, AUTH_ADMIN),
+    ("POST", "/api/trace"): (_h_trace_set, AUTH_ADMIN),
+    ("POST", "/api/uids/add_last"): (_h_uids_add_last, AUTH_ADMIN),
+    ("POST", "/api/uids/add"): (_h_uids_add, AUTH_ADMIN),
+    ("POST", "/api/uids/remove"): (_h_uids_remove, AUTH_ADMIN),
+    ("POST", "/api/uids/set_name"): (_h_uids_set_name, AUTH_ADMIN),
+    ("POST", "/api/uids/batch"): (_h_uids_batch, AUTH_ADMIN),
+    ("GET", "/api/uids/export"): (_h_uids_export, AUTH_ADMIN),
+    ("POST", "/api/uids/import"): (_h_uids_import, AUTH_ADMIN),
+    ("POST", "/api/uids/clear"): (_h_uids_clear, AUTH_ADMIN),
+}
+
+# Route labels for /metrics (anything else is counted as "other")
+_ROUTE_PATHS = set([k[1] for k in ROUTES])
+
+
+def _metrics_route(path):
+    if not path:
+        return "other"
+    q = path.find("?")
+    if q >= 0:
+        path = path[:q]
+    return path if path in _ROUTE_PATHS else "other"
+
+
+def _authorize(req, auth):
+    """Auth middleware: returns True to continue, or sends the rejection."""
+    if auth == AUTH_NONE:
+        return True
+    if auth == AUTH_ADMIN:
+        if _check_admin_token(req):
+            return True
+        _json_response(req.cl, {"ok": False, "msg": "Unauthorized: admin token required"}, status="401 Unauthorized")
+        return False
+    if _check_session(req):
+        return True
+    if auth == AUTH_PAGE:
+        _redirect(req.cl, "/login")
+    else:
+        _json_response(req.cl, {"ok": False, "msg": "Unauthorized"}, status="401 Unauthorized")
+    return False
+
+
+def _dispatch(req):
+    route = ROUTES.get((req.method, req.path))
+    if route is None:
+        _http_send(req.cl, status="404 Not Found", body="Not found")
+    else:
+        handler, auth = route
+        try:
+            if _authorize(req, auth):
+                with trace("http.handler"):
+                    handler(req)
+        except Exception as e:
+            req.keep = False
+            req.cl.keepalive = False  # part of a response may already be out
+            if DEBUG_ERRORS:
+                log_err("HTTP", "handler error:", req.method, req.path, e)
+            _json_response(req.cl, {"ok": False, "msg": "Internal error"}, status="500 Internal Server Error")
+
+
+# -----------------------
+# LOOP SUPERVISOR
+# -----------------------
+# run() marks each stage of an iteration with _loop_stage(); an iteration
+# longer than LOOP_STALL_MS is recorded together with its slowest stage.
+# The current stage is also kept in RTC memory, so after a watchdog reset
+# the next boot can tell where the loop hung.
+LOOP_STAGE = "boot"
+STALLS = []            # worst first: {"at_s", "ms", "stage", "stage_ms"}
+STALL_STATS = {"stalls": 0, "wdt_reset": False, "wdt_stage": ""}
+_stage_t = 0
+_iter_t = 0
+_iter_worst = ""
+_iter_worst_ms = 0
+_WDT = None
+_WDT_TIMER = None
+_RTC = None
+
+
+def _loop_stage(name):
+    global LOOP_STAGE, _stage_t, _iter_worst, _iter_worst_ms
+    t = now_ms()
+    d = ms_diff(t, _stage_t)
+    if d > _iter_worst_ms:
+        _iter_worst_ms = d
+        _iter_worst = LOOP_STAGE
+    LOOP_STAGE = name
+    _stage_t = t
+    if _RTC:
+        try:
+            _RTC.memory(name)
+        except:
+            pass
+
+
+def _stall_record(ms, stage, stage_ms):
+    STALL_STATS["stalls"] += 1
+    log_warn("LOOP", "stall {} ms, slowest stage: {} ({} ms)".format(ms, stage, stage_ms))
+    if len(STALLS) >= LOOP_STALL_TOP and ms <= STALLS[-1]["ms"]:
+        return
+    ev = {"at_s": metrics.uptime_ms // 1000, "ms": ms, "stage": stage, "stage_ms": stage_ms}
+    i = 0
+    while i < len(STALLS) and STALLS[i]["ms"] >= ms:
+        i += 1
+    STALLS.insert(i, ev)
+    if len(STALLS) > LOOP_STALL_TOP:
+        STALLS.pop()
+
+
+def _loop_supervise():
+    """Top of every main loop iteration: close the previous one and feed the watchdog."""
+    global _iter_t, _iter_worst, _iter_worst_ms
+    _loop_stage("loop")
+    t = _stage_t
+    dt = ms_diff(t, _iter_t)
+    metrics.loop_iter(t, dt)
+    if dt >= LOOP_STALL_MS:
+        _stall_record(dt, _iter_worst, _iter_worst_ms)
+    _iter_t = t
+    _iter_worst = ""
+    _iter_worst_ms = 0
+    _wdt_feed()
+
+
+def _wdt_feed():
+    if _WDT:
+        _WDT.feed()
+
+
+def _wdt_hold():
+    """
+    run() is leaving to the REPL: the WDT cannot be stopped, so keep feeding
+    it from a timer, or the board resets LOOP_WDT_MS after Ctrl-C.
+    """
+    global _WDT_TIMER
+    if not _WDT or _WDT_TIMER:
+        return
+    try:
+        from machine import Timer
+        _WDT_TIMER = Timer(0)
+        _WDT_TIMER.init(period=max(100, LOOP_WDT_MS // 4), mode=Timer.PERIODIC, callback=lambda t: _WDT.feed())
+        log_warn("LOOP", "watchdog kept fed from a timer; machine.reset() to restart the app")
+    except Exception as e:
+        log_err("LOOP", "watchdog still running, board resets in", LOOP_WDT_MS, "ms:", e)
+
+
+def _loop_supervisor_start():
+    global _RTC, _WDT, _stage_t, _iter_t
+    try:
+        import machine
+        _RTC = machine.RTC()
+        if machine.reset_cause() == machine.WDT_RESET:
+            STALL_STATS["wdt_reset"] = True
+            STALL_STATS["wdt_stage"] = bytes(_RTC.memory()).decode()
+            log_warn("LOOP", "reset by watchdog, loop was in stage:", STALL_STATS["wdt_stage"] or "?")
+    except Exception as e:
+        _RTC = None
+        if DEBUG_ERRORS:
+            log("LOOP", "RTC memory unavailable:", e)
+
+    if LOOP_WDT_MS > 0:
+        try:
+            from machine import WDT
+            _WDT = WDT(timeout=LOOP_WDT_MS)
+        except Exception as e:
+            log_err("LOOP", "watchdog unavailable:", e)
+    _stage_t = _iter_t = now_ms()
+
+
 # -----------------------
 # MAIN APP LOOP
 # -----------------------
 def run():
-    global LAST_UID_HEX, LAST_ACCESS, LAST_FW, LAST_NAME, EVENT_ID
+    global LAST_UID_HEX, LAST_ACCESS, LAST_FW, LAST_NAME, EVENT_ID, LED, SSE_CLIENT
 
+    logsink.LEVEL = LOG_LEVEL
+    logsink.FILE = LOG_FILE
+    logsink.FILE_MAX = LOG_FILE_MAX
     log("APP", "run() start")
+    tracing.enable(TRACE_ENABLED)
     _load_uids_file_or_init()
+    _access_log_open()
+    card_stats_load()
 
     tg_ready = False
     tg_online_sent = False
@@ -751,24 +3107,26 @@ def run():
 
     if TG_ENABLED and tg_esp and TG_BOT_TOKEN and TG_BOT_TOKEN != "PUT_YOUR_NEW_TOKEN_HERE":
         try:
-            tg_esp.configure(TG_BOT_TOKEN, TG_ADMIN_CHAT_ID, TG_POLL_EVERY_MS)
+            tg_esp.configure(
+                TG_BOT_TOKEN, TG_ADMIN_CHAT_ID, TG_POLL_EVERY_MS,
+                api_host=TG_API_HOST, api_port=TG_API_PORT, api_tls=TG_API_TLS
+            )
             tg_ready = True
         except Exception as e:
             tg_ready = False
             if DEBUG_ERRORS:
-                log("TG", "configure fail:", e)
+                log_err("TG", "configure fail:", e)
 
     # LED
-    led = None
     if LED_PIN is not None:
         try:
-            led = neopixel.NeoPixel(Pin(LED_PIN, Pin.OUT), 1)
-            led[0] = (0, 0, 0)
-            led.write()
+            LED = neopixel.NeoPixel(Pin(LED_PIN, Pin.OUT), 1)
+            LED[0] = (0, 0, 0)
+            LED.write()
         except Exception as e:
-            led = None
+            LED = None
             if DEBUG_ERRORS:
-                log("LED", "init fail:", e)
+                log_err("LED", "init fail:", e)
 
     # Button
     btn = Pin(BTN_PIN, Pin.IN, Pin.PULL_UP)
@@ -842,56 +3200,17 @@ def run():
 
     # Web server
     srv = _start_web_server()
-    sse_client = None
-
-    def _tg_handle_cmd(text: str):
-        nonlocal sse_client
-        global EVENT_ID
-
-        t = (text or "").strip()
-        if t in ("/start", "/help"):
-            return "ESP32 NFC bot\n/last\n/add_last\n/help"
-
-        if t == "/last":
-            return "LAST UID: {}\nName: {}\nAccess: {}".format(
-                LAST_UID_HEX or "-", LAST_NAME or "-", LAST_ACCESS or "-"
-            )
-
-        if t == "/add_last":
-            if not LAST_UID_HEX:
-                return "No LAST UID (tap a card first)"
-
-            ok, msg = uids_add(LAST_UID_HEX)
-
-            if ok and led is not None:
-                blink(led, times=2, on_ms=90, off_ms=60, color=(60, 35, 0))
-
-            EVENT_ID += 1
-            if sse_client:
-                try:
-                    sse_client.send(_sse_event(
-                        EVENT_ID, LAST_FW, LAST_UID_HEX, LAST_ACCESS,
-                        uids_list_hex(), ok=ok, msg=msg, src="tg",
-                        cards=uids_list_cards(), name=LAST_NAME
-                    ).encode())
-                except:
-                    try:
-                        sse_client.close()
-                    except:
-                        pass
-                    sse_client = None
-                    log("SSE", "client disconnected")
-
-            return ("OK: " if ok else "ERR: ") + msg
+    SSE_CLIENT = None
 
-        return None
-
-    last_uid = None
-    last_time = 0
+    _loop_supervisor_start()
+    logsink.SYNC = False  # from here on the loop prints (see "log" stage)
 
     while True:
         try:
+            _loop_supervise()
+
             # ---- Button hold detection ----
+            _loop_stage("button")
             down = btn_is_down()
             if LOG_BTN and down and not was_down:
                 log("BTN", "DOWN (hold start)")
@@ -918,278 +3237,25 @@ def run():
             was_down = down
 
             # ---- Portal request ----
+            _loop_stage("portal")
             if request_portal:
                 request_portal = False
                 btn.irq(handler=None)
-                srv, sse_client = _enter_wifi_setup_and_return(srv, sse_client)
+                srv, SSE_CLIENT = _enter_wifi_setup_and_return(srv, SSE_CLIENT)
                 time.sleep_ms(200)
                 portal_pending = False
                 btn.irq(trigger=Pin.IRQ_FALLING, handler=_irq_handler)
 
-            # ---- HTTP accept ----
+            # ---- HTTP (non-blocking, HTTP_LOOP_BUDGET_MS per iteration) ----
+            _loop_stage("http")
+            _http_loop_begin()
             if srv:
-                try:
-                    cl, _ = srv.accept()
-                except OSError:
-                    cl = None
-
-                if cl:
-                    req = _read_http_request(cl)
-                    if not req:
-                        try:
-                            cl.close()
-                        except:
-                            pass
-                    else:
-                        method, path, headers, body = req
-
-                        # GET /login - Show login page
-                        if method == "GET" and path == "/login":
-                            _http_send(
-                                cl,
-                                status="200 OK",
-                                ctype="text/html; charset=utf-8",
-                                body=ui_html.build_login_html()
-                            )
-                            try:
-                                cl.close()
-                            except:
-                                pass
-
-                        # POST /login - Authenticate and create session
-                        elif method == "POST" and path == "/login":
-                            try:
-                                data = ujson.loads(body.decode() if body else "{}")
-                                username = data.get("username", "")
-                                password = data.get("password", "")
-                                
-                                if username == UI_USER and password == UI_PASS:
-                                    sess_id = _create_session()
-                                    _set_cookie_redirect(cl, "/", sess_id)
-                                    log("AUTH", "Login successful for user:", username)
-                                else:
-                                    _json_response(cl, {"ok": False, "msg": "Invalid credentials"}, status="401 Unauthorized")
-                                    log("AUTH", "Login failed for user:", username)
-                            except Exception as e:
-                                _json_response(cl, {"ok": False, "msg": "Login error"}, status="400 Bad Request")
-                                if DEBUG_ERRORS:
-                                    log("AUTH", "Login error:", e)
-                            try:
-                                cl.close()
-                            except:
-                                pass
-
-                        # GET /logout - Destroy session and redirect to login
-                        elif method == "GET" and path == "/logout":
-                            _destroy_session(headers)
-                            _clear_cookie_redirect(cl, "/login")
-                            log("AUTH", "Logout")
-                            try:
-                                cl.close()
-                            except:
-                                pass
-
-                        # GET / - Main dashboard (protected)
-                        elif method == "GET" and (path == "/" or path.startswith("/?")):
-                            if not _check_session(headers):
-                                _redirect(cl, "/login")
-                                try:
-                                    cl.close()
-                                except:
-                                    pass
-                            else:
-                                _http_send(
-                                    cl,
-                                    status="200 OK",
-                                    ctype="text/html; charset=utf-8",
-                                    body=ui_html.build_index_html(
-                                        LAST_FW,
-                                        LAST_UID_HEX,
-                                        LAST_ACCESS,
-                                        LAST_NAME,
-                                        uids_list_cards()
-                                    )
-                                )
-                                try:
-                                    cl.close()
-                                except:
-                                    pass
-
-                        # GET /events - SSE stream (protected)
-                        elif method == "GET" and path.startswith("/events"):
-                            if not _check_session(headers):
-                                _http_send(cl, status="401 Unauthorized", body="Unauthorized")
-                                try:
-                                    cl.close()
-                                except:
-                                    pass
-                            else:
-                                try:
-                                    cl.send(_sse_headers().encode())
-                                    cl.send(_sse_event(
-                                        EVENT_ID, LAST_FW, LAST_UID_HEX, LAST_ACCESS,
-                                        uids_list_hex(), src="init",
-                                        cards=uids_list_cards(), name=LAST_NAME
-                                    ).encode())
-                                    try:
-                                        if sse_client:
-                                            sse_client.close()
-                                    except:
-                                        pass
-                                    sse_client = cl
-                                    log("SSE", "client connected")
-                                except:
-                                    try:
-                                        cl.close()
-                                    except:
-                                        pass
-
-                        # POST /api/uids/list (protected)
-                        elif method == "POST" and path == "/api/uids/list":
-                            if not _check_session(headers):
-                                _json_response(cl, {"ok": False, "msg": "Unauthorized"}, status="401 Unauthorized")
-                                try:
-                                    cl.close()
-                                except:
-                                    pass
-                            else:
-                                _json_response(cl, {"ok": True, "cards": uids_list_cards()})
-                                try:
-                                    cl.close()
-                                except:
-                                    pass
-
-                        elif method == "POST" and path == "/api/uids/add_last":
-                            if not _check_admin_token(headers, body):
-                                _json_response(cl, {"ok": False, "msg": "Unauthorized: admin token required"}, status="401 Unauthorized")
-                                try:
-                                    cl.close()
-                                except:
-                                    pass
-                            else:
-                                if not LAST_UID_HEX:
-                                    ok = False
-                                    msg = "No LAST UID (tap a card first)"
-                                else:
-                                    ok, msg = uids_add(LAST_UID_HEX)
-
-                                if ok and led is not None:
-                                    blink(led, times=2, on_ms=90, off_ms=60, color=(60, 35, 0))
-
-                                _json_response(cl, {
-                                    "ok": bool(ok),
-                                    "msg": msg,
-                                    "count": len(ALLOWED_UIDS),
-                                    "cards": uids_list_cards()
-                                })
-                                try:
-                                    cl.close()
-                                except:
-                                    pass
-
-                        elif method == "POST" and path == "/api/uids/add":
-                            if not _check_admin_token(headers, body):
-                                _json_response(cl, {"ok": False, "msg": "Unauthorized: admin token required"}, status="401 Unauthorized")
-                                try:
-                                    cl.close()
-                                except:
-                                    pass
-                            else:
-                                try:
-                                    j = ujson.loads(body.decode() if body else "{}")
-                                except:
-                                    j = {}
-                                ok, msg = uids_add(j.get("uid_hex", ""), j.get("name", ""))
-
-                                _json_response(cl, {
-                                    "ok": bool(ok),
-                                    "msg": msg,
-                                    "count": len(ALLOWED_UIDS),
-                                    "cards": uids_list_cards()
-                                })
-                                try:
-                                    cl.close()
-                                except:
-                                    pass
-
-                        elif method == "POST" and path == "/api/uids/remove":
-                            if not _check_admin_token(headers, body):
-                                _json_response(cl, {"ok": False, "msg": "Unauthorized: admin token required"}, status="401 Unauthorized")
-                                try:
-                                    cl.close()
-                                except:
-                                    pass
-                            else:
-                                try:
-                                    j = ujson.loads(body.decode() if body else "{}")
-                                except:
-                                    j = {}
-                                ok, msg = uids_remove(j.get("uid_hex", ""))
-
-                                _json_response(cl, {
-                                    "ok": bool(ok),
-                                    "msg": msg,
-                                    "count": len(ALLOWED_UIDS),
-                                    "cards": uids_list_cards()
-                                })
-                                try:
-                                    cl.close()
-                                except:
-                                    pass
-
-                        elif method == "POST" and path == "/api/uids/set_name":
-                            if not _check_admin_token(headers, body):
-                                _json_response(cl, {"ok": False, "msg": "Unauthorized: admin token required"}, status="401 Unauthorized")
-                                try:
-                                    cl.close()
-                                except:
-                                    pass
-                            else:
-                                try:
-                                    j = ujson.loads(body.decode() if body else "{}")
-                                except:
-                                    j = {}
-                                ok, msg = uids_set_name(j.get("uid_hex", ""), j.get("name", ""))
-
-                                _json_response(cl, {
-                                    "ok": bool(ok),
-                                    "msg": msg,
-                                    "count": len(ALLOWED_UIDS),
-                                    "cards": uids_list_cards()
-                                })
-                                try:
-                                    cl.close()
-                                except:
-                                    pass
-
-                        elif method == "POST" and path == "/api/uids/clear":
-                            if not _check_admin_token(headers, body):
-                                _json_response(cl, {"ok": False, "msg": "Unauthorized: admin token required"}, status="401 Unauthorized")
-                                try:
-                                    cl.close()
-                                except:
-                                    pass
-                            else:
-                                ok = uids_clear_all()
-                                _json_response(cl, {
-                                    "ok": bool(ok),
-                                    "count": len(ALLOWED_UIDS),
-                                    "cards": uids_list_cards(),
-                                    "msg": "Cleared" if ok else "Clear failed"
-                                })
-                                try:
-                                    cl.close()
-                                except:
-                                    pass
-
-                        else:
-                            _http_send(cl, status="404 Not Found", body="Not found")
-                            try:
-                                cl.close()
-                            except:
-                                pass
+                _http_poll(srv)
+            _sse_flush_deltas()
+            _session_tick()
 
             # ---- Telegram: send "online" once ----
+            _loop_stage("tg")
             if TG_ENABLED and tg_ready and tg_esp and (not tg_online_sent):
                 now = now_ms()
                 if ms_diff(now, tg_last_try_ms) > 10000:
@@ -1199,7 +3265,7 @@ def run():
                         tg_online_sent = bool(ok)
                     except Exception as e:
                         if DEBUG_ERRORS:
-                            log("TG", "online send fail:", e)
+                            log_err("TG", "online send fail:", e)
 
             if TG_ENABLED and tg_ready and tg_esp:
                 try:
@@ -1208,73 +3274,101 @@ def run():
                     pass
 
             # ---- NFC read ----
-            uid = nfc.read_uid(timeout_ms=NFC_POLL_TIMEOUT_MS)
+            _loop_stage("nfc")
+            # i2c_read covers the whole read_uid() call, i.e. includes the
+            # wait inside the poll window until the card answered. While a
+            # card stays on the reader, watch() only checks it is still there.
+            t_us = time.ticks_us()
+            nfc_ev, uid = nfc.watch(NFC_POLL_TIMEOUT_MS, NFC_PRESENCE_MISSES)
+            if nfc_ev == "present":
+                metrics.C[metrics.NFC_PRESENCE_CHECKS] += 1
+                uid = None
+            elif nfc_ev == "removed":
+                _card_presence("")
+                uid = None
             if uid:
+                metrics.C[metrics.NFC_READS] += 1
                 op_t0 = time.ticks_ms()
                 t = now_ms()
 
-                if uid == last_uid and ms_diff(t, last_time) < 1200:
+                tap_entry, suppressed = _tap_admit(uid, t)
+                if suppressed:
+                    metrics.C[metrics.TAPS_REPEAT] += 1
                     time.sleep_ms(40)
                 else:
-                    last_uid = uid
-                    last_time = t
+                    _loop_stage("tap")
+                    tap_t0_us = t_us
+                    t_us = _tap_lap("i2c_read", t_us)
 
                     LAST_UID_HEX = uid_bytes_to_hex(uid)
-                    LAST_NAME = UID_NAME_BY_HEX.get(LAST_UID_HEX, "") or ""
-
-                    blink(led, times=1, on_ms=70, off_ms=35, color=(0, 0, 60))
+                    t_us = _tap_lap("uid_hex", t_us)
 
-                    if uid in ALLOWED_UIDS:
-                        LAST_ACCESS = "GRANTED"
-                        log("NFC", "UID", LAST_UID_HEX, "NAME", (LAST_NAME or "-"), "-> GRANTED")
-                        breathe(led, color=(0, 60, 0), duration_ms=500, steps=18)
-                    else:
-                        LAST_ACCESS = "DENIED"
-                        log("NFC", "UID", LAST_UID_HEX, "NAME", (LAST_NAME or "-"), "-> DENIED")
-                        fast_blink(led, color=(60, 0, 0), times=4, on_ms=60, off_ms=60)
+                    LAST_NAME = UID_NAME_BY_HEX.get(LAST_UID_HEX, "") or ""
+                    LAST_ACCESS = "GRANTED" if uid in ALLOWED_UIDS else "DENIED"
+                    metrics.C[metrics.TAPS_GRANTED if LAST_ACCESS == "GRANTED" else metrics.TAPS_DENIED] += 1
+                    access_log_add(uid, LAST_ACCESS == "GRANTED")
+                    card_stats_tap(LAST_UID_HEX, LAST_ACCESS == "GRANTED")
+                    if _tap_decided(tap_entry, LAST_ACCESS == "GRANTED", t):
+                        log_warn("NFC", "lockout", LAST_UID_HEX, "for", TAP_DENY_LOCKOUT_MS, "ms after", TAP_DENY_LOCKOUT_AFTER, "denials")
+                    t_us = _tap_lap("db_lookup", t_us)
+
+                    log("NFC", "UID", LAST_UID_HEX, "NAME", (LAST_NAME or "-"), "->", LAST_ACCESS)
+                    with trace("led.tap"):
+                        blink(LED, times=1, on_ms=70, off_ms=35, color=(0, 0, 60))
+                        if LAST_ACCESS == "GRANTED":
+                            breathe(LED, color=(0, 60, 0), duration_ms=500, steps=18)
+                        else:
+                            fast_blink(LED, color=(60, 0, 0), times=4, on_ms=60, off_ms=60)
+                    t_us = _tap_lap("led", t_us)
 
                     if TG_ENABLED and tg_ready and TG_NOTIFY_ON_TAP and tg_esp:
                         try:
                             tg_esp.notify_uid(LAST_UID_HEX, LAST_ACCESS, device_name=TG_DEVICE_NAME)
                         except Exception:
                             pass
+                        t_us = _tap_lap("tg", t_us)
 
                     EVENT_ID += 1
-                    if sse_client:
-                        try:
-                            sse_client.send(_sse_event(
-                                EVENT_ID, LAST_FW, LAST_UID_HEX, LAST_ACCESS,
-                                uids_list_hex(), src="nfc",
-                                cards=uids_list_cards(), name=LAST_NAME
-                            ).encode())
-                        except:
-                            try:
-                                sse_client.close()
-                            except:
-                                pass
-                            sse_client = None
-                            log("SSE", "client disconnected")
+                    _sse_broadcast(src="nfc")
+                    t_us = _tap_lap("sse", t_us)
+                    TAP_LAT["total"].add(time.ticks_diff(t_us, tap_t0_us))
 
                     op_dt = op_ms(op_t0)
                     op_log("NFC_TAP", op_dt, "{} {} {}".format(LAST_ACCESS, LAST_UID_HEX, (LAST_NAME or "-")))
 
-            time.sleep_ms(NFC_LOOP_SLEEP_MS)
+                # After the tap work, so it does not add to the tap latency
+                _card_presence(uid_bytes_to_hex(uid))
+
+            _loop_stage("log")
+            logsink.drain(LOG_DRAIN_LINES)
+
+            _loop_stage("access_log")
+            access_log_tick()
+            card_stats_tick()
+
+            # Idle wait doubles as HTTP wait: new connections are served
+            # as soon as they arrive instead of after the sleep.
+            _loop_stage("http_wait")
+            if srv:
+                _http_poll(srv, NFC_LOOP_SLEEP_MS)
+            else:
+                time.sleep_ms(NFC_LOOP_SLEEP_MS)
 
         except KeyboardInterrupt:
             log("APP", "Stopped by user")
+            _wdt_hold()
+            access_log_flush()
+            card_stats_flush()
+            logsink.flush()
             try:
                 if srv:
                     srv.close()
             except:
                 pass
-            try:
-                if sse_client:
-                    sse_client.close()
-            except:
-                pass
+            _http_close_all()
             return
 
         except Exception as e:
             if DEBUG_ERRORS:
-                log("ERR", e)
+                log_err("ERR", e)
             time.sleep_ms(120)
\ No newline at end of file
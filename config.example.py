@@ -7,8 +7,20 @@ TG_DEVICE_NAME = "ESP32-NFC-1"
 TG_POLL_EVERY_MS = 2500
 TG_NOTIFY_ON_TAP = True
 
+# Telegram Bot API endpoint (optional, defaults to api.telegram.org:443 over TLS).
+# Point it at tools/tg_stub_server.py to test/benchmark without internet:
+# TG_API_HOST=192.168.1.50
+# TG_API_PORT=8081
+# TG_API_TLS=0
+
 AP_PASS = "12345678"
 
+# Hardware watchdog for the main loop (optional, off by default):
+# LOOP_WDT_MS=60000
+# The board resets if the loop hangs this long. The ESP32 watchdog cannot be
+# stopped: after Ctrl-C the app keeps feeding it from a timer so the REPL stays
+# usable; machine.reset() to start over.
+
 # HTTP Basic Auth for Web UI (optional)
 # Add these to your .env file to enable authentication:
 # UI_AUTH_ENABLED=True
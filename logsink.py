@@ -0,0 +1,128 @@
+# logsink.py
+# Level-filtered log sink: lines go into a RAM ring and are printed / written
+# to flash later by drain() from the main loop, so logging on the hot path
+# costs a compare and a string join instead of a UART write.
+#
+#   logsink.emit(logsink.INFO, ("NFC", "UID", hx))
+#   logsink.drain()          # once per loop iteration
+#   logsink.lines(since)     # recent lines for /api/logs
+import time
+import os
+from array import array
+
+DEBUG = 10
+INFO = 20
+WARN = 30
+ERROR = 40
+LEVEL_NAMES = {DEBUG: "debug", INFO: "info", WARN: "warn", ERROR: "error"}
+
+LEVEL = INFO          # lines below this are dropped before formatting
+SYNC = True           # print right away (boot, before the loop drains)
+RING_SIZE = 64
+
+FILE = ""             # flash log path ("" = off), rotated to FILE + ".1"
+FILE_LEVEL = INFO
+FILE_MAX = 16384      # bytes before rotation
+FILE_BATCH = 16       # lines per flash write...
+FILE_FLUSH_MS = 10000  # ...or after this long
+
+_t = array("I", [0] * RING_SIZE)
+_lv = bytearray(RING_SIZE)
+_txt = [""] * RING_SIZE
+_seq = 0              # lines ever stored; slot = seq % RING_SIZE
+_printed = 0          # console drained up to this seq
+_filed = 0            # flash written up to this seq
+_file_t = 0
+STATS = {"dropped": 0, "file_errors": 0}
+
+
+def emit(level, args):
+    global _seq, _printed, _filed
+    if level < LEVEL:
+        return
+    try:
+        text = " ".join([str(a) for a in args])
+    except:
+        return
+    if SYNC:
+        try:
+            print(text)
+        except:
+            pass
+    i = _seq % RING_SIZE
+    _t[i] = time.ticks_ms() & 0x3FFFFFFF
+    _lv[i] = level
+    _txt[i] = text
+    _seq += 1
+    if SYNC:
+        _printed = _seq
+    # Overwrote a line nobody consumed yet
+    low = _seq - RING_SIZE
+    if _printed < low:
+        STATS["dropped"] += low - _printed
+        _printed = low
+    if _filed < low:
+        _filed = low
+
+
+def drain(max_lines=4):
+    """Print up to max_lines pending lines; write the flash log in batches."""
+    global _printed
+    n = 0
+    while _printed < _seq and n < max_lines:
+        try:
+            print(_txt[_printed % RING_SIZE])
+        except:
+            pass
+        _printed += 1
+        n += 1
+    if FILE and _filed < _seq:
+        if _seq - _filed >= FILE_BATCH or time.ticks_diff(time.ticks_ms(), _file_t) >= FILE_FLUSH_MS:
+            _write_file()
+
+
+def flush():
+    """Everything out now (before a reset / on exit)."""
+    drain(RING_SIZE)
+    if FILE and _filed < _seq:
+        _write_file()
+
+
+def _write_file():
+    global _filed, _file_t
+    _file_t = time.ticks_ms()
+    try:
+        with open(FILE, "a") as f:
+            while _filed < _seq:
+                i = _filed % RING_SIZE
+                if _lv[i] >= FILE_LEVEL:
+                    f.write(_txt[i])
+                    f.write("\n")
+                _filed += 1
+        if os.stat(FILE)[6] > FILE_MAX:
+            try:
+                os.remove(FILE + ".1")
+            except:
+                pass
+            os.rename(FILE, FILE + ".1")
+    except:
+        STATS["file_errors"] += 1
+        _filed = _seq
+
+
+def next_seq():
+    return _seq
+
+
+def lines(since=0, level=DEBUG, limit=RING_SIZE):
+    """Yield (seq, age_ms, level, text) of kept lines with seq >= since, oldest first."""
+    s = max(since, _seq - RING_SIZE, 0)
+    end = _seq
+    now = time.ticks_ms() & 0x3FFFFFFF
+    n = 0
+    while s < end and n < limit:
+        i = s % RING_SIZE
+        if _lv[i] >= level:
+            yield s, time.ticks_diff(now, _t[i]), _lv[i], _txt[i]
+            n += 1
+        s += 1
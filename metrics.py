@@ -0,0 +1,167 @@
+# metrics.py
+# Runtime measurements for app.py. Storage is preallocated, so recording a
+# sample never allocates (safe to call on the tap path).
+import time
+import gc
+from array import array
+
+# -----------------------
+# Counters: one slot each, hot path does C[NAME] += 1
+# -----------------------
+NFC_READS = 0        # a card arrived: read_uid() returned a UID (repeats included)
+TAPS_GRANTED = 1
+TAPS_DENIED = 2
+TAPS_REPEAT = 3      # reads suppressed by the app's tap filter
+LOOP_ITERS = 4
+NFC_PRESENCE_CHECKS = 5  # card still on the reader (no anticollision)
+NFC_REMOVALS = 6
+
+_COUNTERS = (
+    ("nfc_reads_total", "UIDs read from the PN532"),
+    ("nfc_taps_granted_total", "Taps with access granted"),
+    ("nfc_taps_denied_total", "Taps with access denied"),
+    ("nfc_taps_repeat_total", "Reads suppressed by the tap filter (debounce, rate limit, lockout)"),
+    ("loop_iterations_total", "Main loop iterations"),
+    ("nfc_presence_checks_total", "Cheap checks that a card is still on the reader"),
+    ("nfc_removals_total", "Cards taken off the reader"),
+)
+C = array("I", [0] * len(_COUNTERS))
+
+# HTTP responses: (route, status code) -> count (bounded: known routes x codes)
+HTTP_RESPONSES = {}
+
+# Main loop gauges (updated by loop_iter())
+uptime_ms = 0
+loop_per_s = 0
+loop_max_ms = 0
+_loop_win_start = 0
+_loop_win_n = 0
+
+
+def http_count(route, code):
+    k = (route, code)
+    HTTP_RESPONSES[k] = HTTP_RESPONSES.get(k, 0) + 1
+
+
+def loop_iter(now_ms, dt_ms):
+    """Once per main loop iteration; dt_ms = time since the previous one."""
+    global uptime_ms, loop_per_s, loop_max_ms, _loop_win_start, _loop_win_n
+    C[LOOP_ITERS] += 1
+    uptime_ms += dt_ms  # summed, so ticks_ms wrap-around does not matter
+    if dt_ms > loop_max_ms:
+        loop_max_ms = dt_ms
+    _loop_win_n += 1
+    el = time.ticks_diff(now_ms, _loop_win_start)
+    if el >= 1000:
+        loop_per_s = (_loop_win_n * 1000) // el
+        _loop_win_n = 0
+        _loop_win_start = now_ms
+
+
+def heap_largest_free():
+    # GC heap has no "largest block" query; the IDF data heap does
+    try:
+        import esp32
+        return max([h[2] for h in esp32.idf_heap_info(esp32.HEAP_DATA)])
+    except:
+        return -1
+
+
+# -----------------------
+# Prometheus text exposition: small lines, streamed one by one
+# -----------------------
+def line(name, value, labels=""):
+    if labels:
+        return "{}{{{}}} {}\n".format(name, labels, value).encode()
+    return "{} {}\n".format(name, value).encode()
+
+
+def head(name, mtype, help_text):
+    return "# HELP {} {}\n# TYPE {} {}\n".format(name, help_text, name, mtype).encode()
+
+
+def render_core(prefix="nfcpanel_"):
+    """Counters, loop and heap metrics (app.py adds its own after these)."""
+    for i in range(len(_COUNTERS)):
+        name, help_text = _COUNTERS[i]
+        yield head(prefix + name, "counter", help_text)
+        yield line(prefix + name, C[i])
+
+    yield head(prefix + "uptime_seconds", "gauge", "Time since boot")
+    yield line(prefix + "uptime_seconds", uptime_ms // 1000)
+    yield head(prefix + "loop_iterations_per_second", "gauge", "Main loop rate over the last second")
+    yield line(prefix + "loop_iterations_per_second", loop_per_s)
+    yield head(prefix + "loop_stall_max_ms", "gauge", "Longest main loop iteration since boot")
+    yield line(prefix + "loop_stall_max_ms", loop_max_ms)
+
+    yield head(prefix + "heap_free_bytes", "gauge", "Free MicroPython heap")
+    yield line(prefix + "heap_free_bytes", gc.mem_free())
+    yield head(prefix + "heap_alloc_bytes", "gauge", "Allocated MicroPython heap")
+    yield line(prefix + "heap_alloc_bytes", gc.mem_alloc())
+    yield head(prefix + "heap_largest_free_block_bytes", "gauge", "Largest free block of the IDF data heap (-1 = unknown)")
+    yield line(prefix + "heap_largest_free_block_bytes", heap_largest_free())
+
+    yield head(prefix + "http_responses_total", "counter", "HTTP responses by route and status")
+    # Snapshot: the body is pulled across poll rounds while other requests add keys
+    for k, n in list(HTTP_RESPONSES.items()):
+        yield line(prefix + "http_responses_total", n, 'route="{}",code="{}"'.format(k[0], k[1]))
+
+
+# Latency bucket upper bounds, microseconds (one extra bucket for above)
+LAT_BUCKETS_US = (
+    100, 250, 500, 1000, 2500, 5000, 10000, 25000,
+    50000, 100000, 250000, 500000, 1000000, 2500000,
+)
+
+
+class Histogram:
+    """Fixed-bucket histogram; percentiles are bucket upper bounds (capped at max)."""
+
+    def __init__(self, edges=LAT_BUCKETS_US):
+        self.edges = edges
+        self.counts = array("I", [0] * (len(edges) + 1))
+        self.n = 0
+        self.sum = 0
+        self.max = 0
+
+    def add(self, v):
+        edges = self.edges
+        i = 0
+        while i < len(edges) and v > edges[i]:
+            i += 1
+        self.counts[i] += 1
+        self.n += 1
+        self.sum += v
+        if v > self.max:
+            self.max = v
+
+    def percentile(self, q):
+        """q in 0..100."""
+        if not self.n:
+            return 0
+        rank = (self.n * q + 99) // 100
+        acc = 0
+        for i in range(len(self.counts)):
+            acc += self.counts[i]
+            if acc >= rank:
+                if i < len(self.edges):
+                    return min(self.edges[i], self.max)
+                return self.max
+        return self.max
+
+    def summary(self):
+        return {
+            "n": self.n,
+            "avg": (self.sum // self.n) if self.n else 0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.n = 0
+        self.sum = 0
+        self.max = 0
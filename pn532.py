@@ -1,4 +1,5 @@
 import time
+from tracing import trace
 
 PN532_I2C_ADDR = 0x24
 
@@ -6,15 +7,25 @@ PN532_I2C_ADDR = 0x24
 _PN532_HOSTTOPN532 = 0xD4
 _PN532_PN532TOHOST = 0xD5
 
+_CMD_DIAGNOSE            = 0x00
 _CMD_GETFIRMWAREVERSION  = 0x02
 _CMD_SAMCONFIGURATION    = 0x14
+_CMD_INDESELECT          = 0x44
 _CMD_INLISTPASSIVETARGET = 0x4A
+_CMD_INSELECT            = 0x54
+
+_DIAG_ATTENTION = 0x06    # Diagnose test: ISO14443-4 card presence
+_SEL_RES_ISO14443_4 = 0x20
 
 
 class PN532_I2C:
     def __init__(self, i2c, addr=PN532_I2C_ADDR):
         self.i2c = i2c
         self.addr = addr
+        # Card selected by the last successful read_uid() (see watch())
+        self.uid = None
+        self.sel_res = 0
+        self._misses = 0
 
     # ----------------- low level helpers -----------------
 
@@ -130,16 +141,17 @@ class PN532_I2C:
         raise RuntimeError("Bad LCS (no valid frame after retries)")
 
     def _command(self, cmd, params=b"", timeout_ms=1000):
-        data = bytearray([_PN532_HOSTTOPN532, cmd])
-        data.extend(params)
+        with trace("pn532.cmd"):
+            data = bytearray([_PN532_HOSTTOPN532, cmd])
+            data.extend(params)
 
-        self._write_frame(data)
-        resp = self._read_frame(timeout_ms)
+            self._write_frame(data)
+            resp = self._read_frame(timeout_ms)
 
-        # First byte in payload must be cmd+1 (response code)
-        if not resp or resp[0] != (cmd + 1):
-            raise RuntimeError("Unexpected response code")
-        return resp[1:]  # response data
+            # First byte in payload must be cmd+1 (response code)
+            if not resp or resp[0] != (cmd + 1):
+                raise RuntimeError("Unexpected response code")
+            return resp[1:]  # response data
 
     # ----------------- high level API -----------------
 
@@ -160,25 +172,77 @@ class PN532_I2C:
         Doesn't crash on occasional garbage reads.
         """
 
-        # Flush a bit of garbage from buffer (HW-147C often does this)
-        try:
-            self.i2c.readfrom(self.addr, 32)
-            self.i2c.readfrom(self.addr, 32)
-        except Exception:
-            pass
-
-        for _ in range(3):
+        with trace("pn532.read_uid"):
+            # Flush a bit of garbage from buffer (HW-147C often does this)
             try:
-                r = self._command(_CMD_INLISTPASSIVETARGET, bytes([0x01, 0x00]), timeout_ms)
+                self.i2c.readfrom(self.addr, 32)
+                self.i2c.readfrom(self.addr, 32)
+            except Exception:
+                pass
+
+            for _ in range(3):
+                try:
+                    r = self._command(_CMD_INLISTPASSIVETARGET, bytes([0x01, 0x00]), timeout_ms)
+
+                    # Expected: NbTg, Tg, SensRes1, SensRes2, SelRes, UIDLen, UID...
+                    if len(r) >= 7 and r[0] == 0x01:
+                        uid_len = r[5]
+                        self.uid = r[6:6 + uid_len]
+                        self.sel_res = r[4]
+                        self._misses = 0
+                        return self.uid
+
+                    self.uid = None
+                    return None
 
-                # Expected: NbTg, Tg, SensRes1, SensRes2, SelRes, UIDLen, UID...
-                if len(r) >= 7 and r[0] == 0x01:
-                    uid_len = r[5]
-                    return r[6:6 + uid_len]
+                except Exception:
+                    time.sleep_ms(120)
 
-                return None
+            self.uid = None
+            return None
 
+    def card_present(self, timeout_ms=100):
+        """
+        Is the card from the last read_uid() still in the field?
+        No new anticollision: ISO14443-4 cards get a Diagnose attention
+        request, others (MIFARE Classic / Ultralight) are deselected and
+        selected again by their known UID.
+        """
+        if self.uid is None:
+            return False
+        with trace("pn532.present"):
+            try:
+                if self.sel_res & _SEL_RES_ISO14443_4:
+                    r = self._command(_CMD_DIAGNOSE, bytes([_DIAG_ATTENTION]), timeout_ms)
+                else:
+                    self._command(_CMD_INDESELECT, b"\x01", timeout_ms)
+                    r = self._command(_CMD_INSELECT, b"\x01", timeout_ms)
+                # Status byte: low 6 bits = error code, 0 = OK
+                return len(r) > 0 and (r[0] & 0x3F) == 0
             except Exception:
-                time.sleep_ms(120)
+                return False
 
-        return None
+    def watch(self, timeout_ms=2000, misses=2):
+        """
+        Presence-aware polling. Returns (event, uid):
+          ("arrived", uid)  a card was read (full InListPassiveTarget)
+          ("present", uid)  the same card is still on the reader (cheap check)
+          ("removed", uid)  it failed `misses` presence checks in a row
+          (None, None)      no card
+        """
+        if self.uid is not None:
+            if self.card_present():
+                self._misses = 0
+                return "present", self.uid
+            self._misses += 1
+            if self._misses < misses:
+                return "present", self.uid
+            gone = self.uid
+            self.uid = None
+            self._misses = 0
+            return "removed", gone
+
+        uid = self.read_uid(timeout_ms)
+        if uid:
+            return "arrived", uid
+        return None, None
@@ -10,6 +10,8 @@ try:
 except ImportError:
     import ussl
 
+from tracing import trace
+
 _STATE_FILE = "tg_state.json"
 
 # IMPORTANT:
@@ -20,13 +22,32 @@ _admin_chat_id = 0
 _poll_every_ms = 1500
 _last_poll_ms = 0
 
+# Bot API endpoint. Defaults to the real Telegram server; point it at
+# tools/tg_stub_server.py (usually plain HTTP) for offline tests/benchmarks.
+_api_host = "api.telegram.org"
+_api_port = 443
+_api_tls = True
+
+# Counters for the app's /metrics endpoint
+STATS = {"sent": 0, "send_failed": 0, "polls": 0, "poll_failed": 0}
+
 
-def configure(bot_token: str, admin_chat_id: int, poll_every_ms: int = 1500):
-    global _bot_token, _admin_chat_id, _poll_every_ms
+def configure(bot_token: str, admin_chat_id: int, poll_every_ms: int = 1500,
+              api_host: str = None, api_port: int = None, api_tls: bool = None):
+    global _bot_token, _admin_chat_id, _poll_every_ms, _api_host, _api_port, _api_tls
     _bot_token = (bot_token or "").strip()
     _admin_chat_id = int(admin_chat_id) if admin_chat_id is not None else 0
     _poll_every_ms = int(poll_every_ms) if poll_every_ms else 1500
 
+    if api_tls is not None:
+        _api_tls = bool(api_tls)
+    if api_host:
+        _api_host = str(api_host).strip()
+    if api_port:
+        _api_port = int(api_port)
+    elif api_tls is not None:
+        _api_port = 443 if _api_tls else 80
+
 
 def _load_json(path: str, default):
     try:
@@ -44,21 +65,6 @@ def _save_json(path: str, obj):
         pass
 
 
-def _urlencode(s: str) -> str:
-    if s is None:
-        return ""
-    out = []
-    for ch in str(s):
-        o = ord(ch)
-        if (48 <= o <= 57) or (65 <= o <= 90) or (97 <= o <= 122) or ch in "-_.~":
-            out.append(ch)
-        elif ch == " ":
-            out.append("%20")
-        else:
-            out.append("%{:02X}".format(o & 0xFF))
-    return "".join(out)
-
-
 def _tls_wrap(sock, host: str):
     # Some ports accept server_hostname; keep safe fallback.
     try:
@@ -67,92 +73,113 @@ def _tls_wrap(sock, host: str):
         return ussl.wrap_socket(sock)
 
 
-def _https_get_find_ok(host: str, path: str, timeout=8) -> bool:
+def _host_header(host: str, port: int, tls: bool) -> str:
+    if port == (443 if tls else 80):
+        return host
+    return "{}:{}".format(host, port)
+
+
+def _open(host: str, port: int, tls: bool, timeout):
     """
-    Streaming read: doesn't store full response.
-    Returns True if '"ok":true' seen in stream.
+    Connect to host:port, optionally wrapped in TLS.
+    Returns (raw_socket, stream); stream is the raw socket when tls is off.
     """
     gc.collect()
-    ai = usocket.getaddrinfo(host, 443, 0, usocket.SOCK_STREAM)[0][-1]
+    ai = usocket.getaddrinfo(host, port, 0, usocket.SOCK_STREAM)[0][-1]
     s = usocket.socket()
     s.settimeout(timeout)
-    s.connect(ai)
-
-    gc.collect()
-    ss = _tls_wrap(s, host)
-
-    req = "GET {} HTTP/1.1\r\nHost: {}\r\nConnection: close\r\nUser-Agent: esp32\r\n\r\n".format(path, host)
-    ss.write(req.encode())
-
-    needle1 = b'"ok":true'
-    needle2 = b'"ok": true'
-    buf = b""
-    ok = False
-
-    while True:
+    try:
+        s.connect(ai)
+        if not tls:
+            return s, s
+        gc.collect()
+        return s, _tls_wrap(s, host)
+    except Exception:
         try:
-            chunk = ss.read(256)
+            s.close()
         except Exception:
-            break
-        if not chunk:
-            break
+            pass
+        raise
 
-        buf = (buf + chunk)[-512:]
-        if (needle1 in buf) or (needle2 in buf):
-            ok = True
-            break
 
-    try:
-        ss.close()
-    except Exception:
-        pass
+def _close(s, ss):
+    if ss is not s:
+        try:
+            ss.close()
+        except Exception:
+            pass
     try:
         s.close()
     except Exception:
         pass
-
     gc.collect()
-    return ok
 
 
-def _https_get_small(host: str, path: str, timeout=8, max_bytes=3500) -> str:
+def _write_post_json(ss, host: str, port: int, tls: bool, path: str, body: bytes):
+    hdr = (
+        "POST {} HTTP/1.1\r\nHost: {}\r\n"
+        "Content-Type: application/json\r\nContent-Length: {}\r\n"
+        "Connection: close\r\nUser-Agent: esp32\r\n\r\n"
+    ).format(path, _host_header(host, port, tls), len(body))
+    ss.write(hdr.encode())
+    ss.write(body)
+
+
+def _https_post_find_ok(host: str, path: str, body: bytes, timeout=8, port=443, tls=True) -> bool:
     """
-    Returns response string but capped. Used for getUpdates.
+    POST a JSON body. Streaming read: doesn't store full response.
+    Returns True if '"ok":true' seen in stream.
     """
-    gc.collect()
-    ai = usocket.getaddrinfo(host, 443, 0, usocket.SOCK_STREAM)[0][-1]
-    s = usocket.socket()
-    s.settimeout(timeout)
-    s.connect(ai)
+    s, ss = _open(host, port, tls, timeout)
 
-    gc.collect()
-    ss = _tls_wrap(s, host)
+    needle1 = b'"ok":true'
+    needle2 = b'"ok": true'
+    buf = b""
+    ok = False
 
-    req = "GET {} HTTP/1.1\r\nHost: {}\r\nConnection: close\r\nUser-Agent: esp32\r\n\r\n".format(path, host)
-    ss.write(req.encode())
+    try:
+        _write_post_json(ss, host, port, tls, path, body)
+
+        while True:
+            try:
+                chunk = ss.read(256)
+            except Exception:
+                break
+            if not chunk:
+                break
+
+            buf = (buf + chunk)[-512:]
+            if (needle1 in buf) or (needle2 in buf):
+                ok = True
+                break
+    finally:
+        _close(s, ss)
+    return ok
 
-    data = b""
-    while True:
-        try:
-            chunk = ss.read(256)
-        except Exception:
-            break
-        if not chunk:
-            break
-        data += chunk
-        if len(data) >= max_bytes:
-            break
 
+def _https_post_small(host: str, path: str, body: bytes, timeout=8, max_bytes=3500, port=443, tls=True) -> str:
+    """
+    POST a JSON body. Returns response string but capped. Used for getUpdates.
+    """
+    s, ss = _open(host, port, tls, timeout)
+
+    data = b""
     try:
-        ss.close()
-    except Exception:
-        pass
-    try:
-        s.close()
-    except Exception:
-        pass
+        _write_post_json(ss, host, port, tls, path, body)
+
+        while True:
+            try:
+                chunk = ss.read(256)
+            except Exception:
+                break
+            if not chunk:
+                break
+            data += chunk
+            if len(data) >= max_bytes:
+                break
+    finally:
+        _close(s, ss)
 
-    gc.collect()
     try:
         return data.decode()
     except Exception:
@@ -162,15 +189,19 @@ def _https_get_small(host: str, path: str, timeout=8, max_bytes=3500) -> str:
 def send_text(text: str) -> bool:
     if not _bot_token or not _admin_chat_id:
         return False
-    host = "api.telegram.org"
-    t = _urlencode(text)
-    path = "/bot{}/sendMessage?chat_id={}&text={}&disable_web_page_preview=1".format(
-        _bot_token, _admin_chat_id, t
-    )
+    path = "/bot{}/sendMessage".format(_bot_token)
+    body = ujson.dumps({
+        "chat_id": _admin_chat_id,
+        "text": "" if text is None else str(text),
+        "disable_web_page_preview": True,
+    }).encode()
     try:
-        return _https_get_find_ok(host, path)
+        with trace("tg.send"):
+            ok = _https_post_find_ok(_api_host, path, body, port=_api_port, tls=_api_tls)
     except Exception:
-        return False
+        ok = False
+    STATS["sent" if ok else "send_failed"] += 1
+    return ok
 
 
 def normalize_uid(uid_hex: str):
@@ -205,7 +236,8 @@ def _load_state():
 
 
 def _save_state(st):
-    _save_json(_STATE_FILE, st)
+    with trace("flash.tg_state"):
+        _save_json(_STATE_FILE, st)
 
 
 def _extract_updates_minimal(resp: str):
@@ -283,12 +315,15 @@ def tick(on_command_cb):
     st = _load_state()
     offset = int(st.get("offset", 0))
 
-    host = "api.telegram.org"
-    path = "/bot{}/getUpdates?timeout=0&offset={}&limit=2".format(_bot_token, offset)
+    path = "/bot{}/getUpdates".format(_bot_token)
+    body = ujson.dumps({"timeout": 0, "offset": offset, "limit": 2}).encode()
 
+    STATS["polls"] += 1
     try:
-        resp = _https_get_small(host, path)
+        with trace("tg.poll"):
+            resp = _https_post_small(_api_host, path, body, port=_api_port, tls=_api_tls)
     except Exception:
+        STATS["poll_failed"] += 1
         return
 
     items = _extract_updates_minimal(resp)
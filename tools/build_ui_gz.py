@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+# tools/build_ui_gz.py
+# Precompress the web UI pages for the device (runs on a PC, CPython 3.8+).
+#
+# The device can gzip the pages itself only if its MicroPython build has
+# deflate compression. Otherwise upload the files written here; their names
+# carry the page ETag, so a stale copy from an older firmware is ignored.
+#
+#   python3 tools/build_ui_gz.py build
+#   mpremote cp build/ui_*.gz :
+
+import gzip
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import ui_html  # noqa: E402
+
+
+def main(argv):
+    out_dir = argv[1] if len(argv) > 1 else "build"
+    os.makedirs(out_dir, exist_ok=True)
+    for name in sorted(ui_html._PAGES):
+        raw = ui_html._PAGES[name]
+        etag = ui_html.page_etag(raw)
+        gz = gzip.compress(raw, 9, mtime=0)
+        path = os.path.join(out_dir, ui_html.gz_file_name(name, etag))
+        with open(path, "wb") as f:
+            f.write(gz)
+        print("{:<6} {:>6} B -> {:>6} B ({:.0%})  {}".format(name, len(raw), len(gz), len(gz) / len(raw), path))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,150 @@
+# tools/tg_bench.py
+# tg_esp benchmark against tools/tg_stub_server.py (runs on the ESP32 or unix MicroPython).
+#
+# 1) On the PC:     python3 tools/tg_stub_server.py --port 8081 --quiet
+# 2) Copy this file next to tg_esp.py (and tracing.py) on the device, then in the REPL:
+#       import tg_bench
+#       tg_bench.run("192.168.1.50", port=8081, tls=False, n=20)
+#
+# Reports:
+#   - notifications per second (notify_uid -> sendMessage)
+#   - command round-trip: /_stub/inject -> tick() -> getUpdates -> callback -> reply sent
+#   - heap peak per operation: highest heap use seen during the call, above a
+#     gc.collect() before it. tg_esp collects on its own (_open/_close), so the
+#     heap is also sampled right before each of those collections; a collection
+#     the allocator triggers by itself mid-call can still hide part of the peak.
+import time
+import gc
+import ujson
+import tg_esp
+
+BENCH_TOKEN = "000000:BENCH"
+BENCH_CHAT_ID = 123456789
+
+
+def _ctl(path, obj=None, timeout=5):
+    """Small HTTP call to the stub control endpoints (same host/port/TLS as tg_esp)."""
+    body = ujson.dumps(obj or {}).encode()
+    s, ss = tg_esp._open(tg_esp._api_host, tg_esp._api_port, tg_esp._api_tls, timeout)
+    try:
+        hdr = (
+            "POST {} HTTP/1.1\r\nHost: {}\r\nContent-Type: application/json\r\n"
+            "Content-Length: {}\r\nConnection: close\r\n\r\n"
+        ).format(path, tg_esp._host_header(tg_esp._api_host, tg_esp._api_port, tg_esp._api_tls), len(body))
+        ss.write(hdr.encode())
+        ss.write(body)
+        data = b""
+        while True:
+            chunk = ss.read(256)
+            if not chunk:
+                break
+            data += chunk
+    finally:
+        tg_esp._close(s, ss)
+    p = data.find(b"\r\n\r\n")
+    try:
+        return ujson.loads(data[p + 4:] if p >= 0 else data)
+    except Exception:
+        return {}
+
+
+class _GcProbe:
+    """Stands in for tg_esp's gc module: notes the heap use before each collect()."""
+
+    def __init__(self):
+        self.high = 0
+
+    def collect(self):
+        a = gc.mem_alloc()
+        if a > self.high:
+            self.high = a
+        gc.collect()
+
+    def mem_alloc(self):
+        return gc.mem_alloc()
+
+    def mem_free(self):
+        return gc.mem_free()
+
+
+def _measure(fn, *args):
+    probe = _GcProbe()
+    gc.collect()
+    a0 = gc.mem_alloc()
+    tg_esp.gc = probe
+    t0 = time.ticks_us()
+    try:
+        r = fn(*args)
+    finally:
+        dt = time.ticks_diff(time.ticks_us(), t0)
+        tg_esp.gc = gc
+    peak = max(probe.high, gc.mem_alloc()) - a0
+    return r, dt, peak
+
+
+def _summary(name, values, unit):
+    if not values:
+        print("  {:<22} (no samples)".format(name))
+        return
+    v = sorted(values)
+    n = len(v)
+    p95 = v[min(n - 1, (n * 95) // 100)]
+    print("  {:<22} n={} min={} avg={} p95={} max={} {}".format(
+        name, n, v[0], sum(v) // n, p95, v[-1], unit))
+
+
+def bench_notify(n):
+    lat_us = []
+    heap = []
+    t0 = time.ticks_ms()
+    for i in range(n):
+        _, dt, peak = _measure(tg_esp.notify_uid, "15 D6 14 {:02X}".format(i & 0xFF), "GRANTED", "BENCH")
+        lat_us.append(dt)
+        heap.append(peak)
+    elapsed = time.ticks_diff(time.ticks_ms(), t0)
+
+    st = _ctl("/_stub/stats").get("counters", {})
+    sent = st.get("sendMessage", 0)
+    fails = max(0, n - sent)
+
+    print("notify_uid x{}: {} ms total, {:.2f} msg/s, failed={}".format(
+        n, elapsed, (n * 1000.0 / elapsed) if elapsed else 0.0, fails))
+    _summary("latency", [x // 1000 for x in lat_us], "ms")
+    _summary("heap peak", heap, "B")
+
+
+def bench_commands(n):
+    rtt_us = []
+    heap = []
+    handled = [0]
+
+    def on_cmd(text):
+        handled[0] += 1
+        return "bench reply: " + (text or "")
+
+    for _ in range(n):
+        _ctl("/_stub/inject", {"text": "/last", "count": 1, "chat_id": BENCH_CHAT_ID})
+        time.sleep_ms(2)  # let the poll interval (1 ms) elapse
+        _, dt, peak = _measure(tg_esp.tick, on_cmd)
+        rtt_us.append(dt)
+        heap.append(peak)
+
+    print("commands x{}: handled={}".format(n, handled[0]))
+    _summary("round-trip", [x // 1000 for x in rtt_us], "ms")
+    _summary("heap peak", heap, "B")
+
+
+def run(host, port=8081, tls=False, n=20, token=BENCH_TOKEN, chat_id=BENCH_CHAT_ID):
+    tg_esp.configure(token, chat_id, poll_every_ms=1, api_host=host, api_port=port, api_tls=tls)
+    print("tg_bench -> {}://{}:{}".format("https" if tls else "http", host, port))
+
+    gc.collect()
+    free0 = gc.mem_free()
+    _ctl("/_stub/reset")
+    tg_esp._save_state({"offset": 0})  # stub update ids restart after reset
+
+    bench_notify(n)
+    bench_commands(n)
+
+    gc.collect()
+    print("heap free: start={} end={} (delta {})".format(free0, gc.mem_free(), gc.mem_free() - free0))
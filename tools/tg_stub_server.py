@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# tools/tg_stub_server.py
+# Local stand-in for the Telegram Bot API (runs on a PC, CPython 3.8+).
+#
+# Implements just what tg_esp.py uses:
+#   /bot<token>/sendMessage  (GET query string or POST form/JSON)
+#   /bot<token>/getUpdates   (offset / limit / timeout)
+#
+# Test controls (not part of the Bot API):
+#   POST /_stub/inject  {"text": "/last", "count": 1}  -> queue updates
+#   GET  /_stub/stats                                 -> counters + last messages
+#   POST /_stub/reset                                 -> clear queue and counters
+#
+# Examples:
+#   python3 tools/tg_stub_server.py --port 8081
+#   python3 tools/tg_stub_server.py --port 8443 --tls --cert cert.pem --key key.pem
+#   python3 tools/tg_stub_server.py --latency-ms 300 --jitter-ms 200 --error-rate 0.1
+#   python3 tools/tg_stub_server.py --burst-size 5 --burst-every 10 --burst-text /last
+#
+# On the device set TG_API_HOST / TG_API_PORT / TG_API_TLS in .env
+# (or call tg_esp.configure(..., api_host=, api_port=, api_tls=)).
+
+import argparse
+import json
+import random
+import ssl
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class StubState:
+    def __init__(self, chat_id, keep_messages=50):
+        self.lock = threading.Lock()
+        self.chat_id = chat_id
+        self.keep_messages = keep_messages
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.next_update_id = 1000
+            self.next_message_id = 1
+            self.updates = []          # pending updates (dicts)
+            self.messages = []         # last sendMessage payloads
+            self.counters = {
+                "sendMessage": 0,
+                "getUpdates": 0,
+                "updates_delivered": 0,
+                "injected": 0,
+                "errors_injected": 0,
+                "bad_requests": 0,
+            }
+            self.started = time.time()
+
+    def inject(self, text, count=1, chat_id=None):
+        with self.lock:
+            for _ in range(max(1, int(count))):
+                upd = {
+                    "update_id": self.next_update_id,
+                    "message": {
+                        "message_id": self.next_message_id,
+                        "from": {"id": chat_id or self.chat_id, "is_bot": False, "first_name": "stub"},
+                        "chat": {"id": chat_id or self.chat_id, "type": "private"},
+                        "date": int(time.time()),
+                        "text": text,
+                    },
+                }
+                self.next_update_id += 1
+                self.next_message_id += 1
+                self.updates.append(upd)
+                self.counters["injected"] += 1
+
+    def get_updates(self, offset, limit):
+        with self.lock:
+            self.counters["getUpdates"] += 1
+            # Like Telegram: offset confirms everything below it.
+            if offset:
+                self.updates = [u for u in self.updates if u["update_id"] >= offset]
+            out = self.updates[:max(1, min(100, limit))]
+            self.counters["updates_delivered"] += len(out)
+            return out
+
+    def add_message(self, chat_id, text):
+        with self.lock:
+            self.counters["sendMessage"] += 1
+            msg = {
+                "message_id": self.next_message_id,
+                "chat": {"id": chat_id, "type": "private"},
+                "date": int(time.time()),
+                "text": text,
+            }
+            self.next_message_id += 1
+            self.messages.append({"t": time.time(), "chat_id": chat_id, "text": text})
+            if len(self.messages) > self.keep_messages:
+                self.messages = self.messages[-self.keep_messages:]
+            return msg
+
+    def stats(self):
+        with self.lock:
+            return {
+                "uptime_s": round(time.time() - self.started, 3),
+                "pending_updates": len(self.updates),
+                "counters": dict(self.counters),
+                "last_messages": list(self.messages[-10:]),
+            }
+
+
+def make_handler(state, opts):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        server_version = "tg-stub/1.0"
+
+        def log_message(self, fmt, *args):
+            if not opts.quiet:
+                super().log_message(fmt, *args)
+
+        # ---- helpers ----
+        def _send_json(self, obj, status=200):
+            body = json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.wfile.write(body)
+            self.close_connection = True
+
+        def _read_params(self):
+            parts = urlsplit(self.path)
+            params = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+            if self.command == "POST":
+                n = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(n) if n > 0 else b""
+                ctype = (self.headers.get("Content-Type") or "").lower()
+                if raw and "json" in ctype:
+                    obj = json.loads(raw.decode("utf-8"))
+                    if isinstance(obj, dict):
+                        params.update(obj)
+                elif raw:
+                    for k, v in parse_qs(raw.decode("utf-8")).items():
+                        params[k] = v[-1]
+            return parts.path, params
+
+        def _delay(self):
+            ms = opts.latency_ms
+            if opts.jitter_ms:
+                ms += random.randint(0, opts.jitter_ms)
+            if ms > 0:
+                time.sleep(ms / 1000.0)
+
+        def _maybe_fail(self):
+            """Error injection. Returns True if the request was consumed."""
+            if opts.error_rate <= 0 or random.random() >= opts.error_rate:
+                return False
+            with state.lock:
+                state.counters["errors_injected"] += 1
+            if opts.error_mode == "drop":
+                self.close_connection = True
+                try:
+                    self.connection.shutdown(2)
+                except OSError:
+                    pass
+                return True
+            if opts.error_mode == "hang":
+                time.sleep(opts.hang_s)
+                self.close_connection = True
+                return True
+            status = opts.error_status
+            self._send_json({
+                "ok": False,
+                "error_code": status,
+                "description": "stub: injected error",
+                "parameters": {"retry_after": 1} if status == 429 else {},
+            }, status=status)
+            return True
+
+        # ---- routes ----
+        def _handle(self):
+            try:
+                path, params = self._read_params()
+            except Exception as e:
+                with state.lock:
+                    state.counters["bad_requests"] += 1
+                self._send_json({"ok": False, "error_code": 400, "description": str(e)}, status=400)
+                return
+
+            if path == "/_stub/stats":
+                self._send_json(state.stats())
+                return
+            if path == "/_stub/reset":
+                state.reset()
+                self._send_json({"ok": True})
+                return
+            if path == "/_stub/inject":
+                state.inject(str(params.get("text") or "/last"), int(params.get("count") or 1),
+                             int(params.get("chat_id") or 0) or None)
+                self._send_json({"ok": True, "pending": state.stats()["pending_updates"]})
+                return
+
+            if not path.startswith("/bot") or "/" not in path[4:]:
+                self._send_json({"ok": False, "error_code": 404, "description": "Not Found"}, status=404)
+                return
+            token, method = path[4:].split("/", 1)
+            if opts.token and token != opts.token:
+                self._send_json({"ok": False, "error_code": 401, "description": "Unauthorized"}, status=401)
+                return
+
+            self._delay()
+            if self._maybe_fail():
+                return
+
+            if method == "sendMessage":
+                text = params.get("text")
+                chat_id = params.get("chat_id")
+                if text is None or chat_id is None:
+                    with state.lock:
+                        state.counters["bad_requests"] += 1
+                    self._send_json({"ok": False, "error_code": 400,
+                                     "description": "Bad Request: message text is empty"}, status=400)
+                    return
+                msg = state.add_message(int(chat_id), str(text))
+                if opts.echo:
+                    print("sendMessage ->", chat_id, repr(text))
+                self._send_json({"ok": True, "result": msg})
+                return
+
+            if method == "getUpdates":
+                offset = int(params.get("offset") or 0)
+                limit = int(params.get("limit") or 100)
+                self._send_json({"ok": True, "result": state.get_updates(offset, limit)})
+                return
+
+            self._send_json({"ok": False, "error_code": 404, "description": "Not Found: method not found"},
+                            status=404)
+
+        def do_GET(self):
+            self._handle()
+
+        def do_POST(self):
+            self._handle()
+
+    return Handler
+
+
+def _burst_loop(state, opts, stop):
+    while not stop.wait(opts.burst_every):
+        state.inject(opts.burst_text, opts.burst_size)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Local Telegram Bot API stand-in for tg_esp.py")
+    ap.add_argument("--host", default="0.0.0.0")
+    ap.add_argument("--port", type=int, default=8081)
+    ap.add_argument("--tls", action="store_true", help="serve HTTPS (needs --cert/--key)")
+    ap.add_argument("--cert", default="")
+    ap.add_argument("--key", default="")
+    ap.add_argument("--token", default="", help="accept only this bot token (default: any)")
+    ap.add_argument("--chat-id", type=int, default=123456789, help="chat id used for injected updates")
+    ap.add_argument("--latency-ms", type=int, default=0, help="fixed delay before each Bot API reply")
+    ap.add_argument("--jitter-ms", type=int, default=0, help="extra random delay 0..N ms")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="0..1 probability of an injected failure")
+    ap.add_argument("--error-mode", choices=("status", "drop", "hang"), default="status")
+    ap.add_argument("--error-status", type=int, default=500, help="HTTP status for --error-mode status")
+    ap.add_argument("--hang-s", type=float, default=10.0, help="stall time for --error-mode hang")
+    ap.add_argument("--burst-size", type=int, default=0, help="inject N updates every --burst-every s")
+    ap.add_argument("--burst-every", type=float, default=10.0)
+    ap.add_argument("--burst-text", default="/last")
+    ap.add_argument("--echo", action="store_true", help="print every sendMessage")
+    ap.add_argument("--quiet", action="store_true", help="no per-request access log")
+    opts = ap.parse_args(argv)
+
+    state = StubState(opts.chat_id)
+    httpd = ThreadingHTTPServer((opts.host, opts.port), make_handler(state, opts))
+    httpd.daemon_threads = True
+
+    if opts.tls:
+        if not opts.cert or not opts.key:
+            ap.error("--tls needs --cert and --key "
+                     "(e.g. openssl req -x509 -newkey rsa:2048 -nodes -keyout key.pem -out cert.pem -days 30 -subj /CN=stub)")
+        ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        ctx.load_cert_chain(opts.cert, opts.key)
+        httpd.socket = ctx.wrap_socket(httpd.socket, server_side=True)
+
+    stop = threading.Event()
+    if opts.burst_size > 0:
+        threading.Thread(target=_burst_loop, args=(state, opts, stop), daemon=True).start()
+
+    print("tg stub listening on {}://{}:{} (chat_id={})".format(
+        "https" if opts.tls else "http", opts.host, opts.port, opts.chat_id))
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# tracing.py
+# Span tracing into a preallocated ring buffer, exported as Chrome Trace
+# Event JSON (open it in chrome://tracing or https://ui.perfetto.dev).
+#
+#   from tracing import trace
+#   with trace("http.read"):
+#       ...
+#
+# Disabled (default), trace() returns a shared no-op object: a span costs
+# one call and two empty methods. Enabled, spans are written into fixed
+# arrays; nothing is allocated per span once its name has been seen.
+# Span names should be string literals (they are kept for the export).
+import time
+from array import array
+
+RING_SIZE = 256   # spans kept (oldest overwritten)
+MAX_DEPTH = 8     # nesting deeper than this is not recorded
+
+ENABLED = False
+
+NAMES = []        # span id -> name
+_IDS = {}         # name -> span id
+
+_id = array("H", [0] * RING_SIZE)
+_start = array("I", [0] * RING_SIZE)  # ticks_us (fits 30 bits on ESP32)
+_dur = array("I", [0] * RING_SIZE)
+_pos = 0
+_count = 0
+_depth = 0
+
+
+def _record(sid, t0, dur):
+    global _pos, _count
+    i = _pos
+    _id[i] = sid
+    _start[i] = t0
+    _dur[i] = dur
+    i += 1
+    _pos = 0 if i >= RING_SIZE else i
+    if _count < RING_SIZE:
+        _count += 1
+
+
+class _Span:
+    def __init__(self):
+        self.sid = 0
+        self.t0 = 0
+
+    def __enter__(self):
+        global _depth
+        _depth += 1
+        self.t0 = time.ticks_us()
+        return self
+
+    def __exit__(self, *exc):
+        global _depth
+        _record(self.sid, self.t0, time.ticks_diff(time.ticks_us(), self.t0))
+        _depth -= 1
+        return False
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+_STACK = [_Span() for _ in range(MAX_DEPTH)]
+
+
+def trace(name):
+    if not ENABLED or _depth >= MAX_DEPTH:
+        return _NO_SPAN
+    sid = _IDS.get(name)
+    if sid is None:
+        sid = len(NAMES)
+        NAMES.append(name)
+        _IDS[name] = sid
+    span = _STACK[_depth]
+    span.sid = sid
+    return span
+
+
+def clear():
+    global _pos, _count
+    _pos = 0
+    _count = 0
+
+
+def enable(on=True):
+    """Turn tracing on/off; the ring starts empty either way."""
+    global ENABLED
+    ENABLED = bool(on)
+    clear()
+
+
+def chrome_json():
+    """
+    Yield the recorded spans (oldest first) as Chrome Trace Event JSON pieces.
+    Works on a copy, so spans recorded while the export streams don't mix in.
+    """
+    n = _count
+    first = (_pos - n) % RING_SIZE
+    ids = array("H", _id)
+    starts = array("I", _start)
+    durs = array("I", _dur)
+
+    # Parents are recorded after their children: find the earliest start
+    base = starts[first]
+    for k in range(n):
+        t = starts[(first + k) % RING_SIZE]
+        if time.ticks_diff(t, base) < 0:
+            base = t
+
+    yield b'{"displayTimeUnit":"ms","traceEvents":['
+    sep = ""
+    for k in range(n):
+        i = (first + k) % RING_SIZE
+        yield '{}{{"name":"{}","cat":"{}","ph":"X","pid":1,"tid":1,"ts":{},"dur":{}}}'.format(
+            sep, NAMES[ids[i]], NAMES[ids[i]].split(".", 1)[0], time.ticks_diff(starts[i], base), durs[i]).encode()
+        sep = ","
+    yield b"]}"
@@ -1,8 +1,16 @@
 # ui_html.py
-# UI builder for ESP32 NFC web panel
+# UI for ESP32 NFC web panel
 # - colored badge for GRANTED/DENIED
 # - toast notifications (top)
 # - History (client-side for now; device-side later)
+#
+# Pages are static shells (no server-side templating): live data comes from
+# GET /api/bootstrap + SSE. Each shell is kept as UTF-8 bytes plus a gzip
+# copy and a strong ETag, built once (see asset()).
+#
+# The same bytes double as a template for clients that need a server-rendered
+# page: <!--$name-->default<!--/--> marks a slot. compile_template() splits the
+# page once into static memoryview segments + slot names, render() streams it.
 
 def html_escape(s):
     s = str(s if s is not None else "")
@@ -12,9 +20,7 @@ def html_escape(s):
     return s
 
 
-def build_login_html():
-    """Build a custom login page"""
-    html = """<!doctype html>
+_LOGIN_HTML = """<!doctype html>
 <html>
 <head>
   <meta charset="utf-8"/>
@@ -187,38 +193,10 @@ def build_login_html():
   </script>
 </body>
 </html>
-"""
-    return html
-
-
-def build_index_html(last_fw, last_uid, last_access, last_name, cards):
-    # cards: [{"uid":"15 D6 ...", "name":"..."}, ...]
-    # --- UPDATED: render actions (edit/delete) but keep original UI intact ---
-    uids_li = "".join([
-        "<li class='uid-item'>"
-        "  <span class='uid-text'>{}</span>"
-        "  <span class='uid-actions'>"
-        "    <button class='iconBtn' title='Edit' onclick='pickUid({}, {})'>✎</button>"
-        "    <button class='iconBtn danger' title='Delete' onclick='delUid({})'>✖</button>"
-        "  </span>"
-        "</li>".format(
-            html_escape(c["uid"] + (" — " + c["name"] if c.get("name") else "")),
-            ujson_safe(html_escape(c.get("uid", ""))),
-            ujson_safe(html_escape(c.get("name", ""))),
-            ujson_safe(html_escape(c.get("uid", ""))),
-        )
-        for c in (cards or [])
-    ])
-
-    # status class
-    acc = (last_access or "").upper()
-    acc_class = "pill-neutral"
-    if acc == "GRANTED":
-        acc_class = "pill-good"
-    elif acc == "DENIED":
-        acc_class = "pill-bad"
+""".encode()
+
 
-    html = """<!doctype html>
+_INDEX_HTML = """<!doctype html>
 <html>
 <head>
   <meta charset="utf-8"/>
@@ -370,6 +348,10 @@ def build_index_html(last_fw, last_uid, last_access, last_name, cards):
     button.danger  { border-color: rgba(220,38,38,0.35); }
 
     .uids { margin:12px 0 0; padding:0; list-style:none; display:grid; gap:8px; }
+    /* virtualized list (JS adds .virt; the server-rendered fallback stays a plain list) */
+    .uids.virt { display:block; position:relative; height:420px; overflow-y:auto; overscroll-behavior:contain; }
+    .uids.virt .uid-item { position:absolute; left:0; right:4px; height:52px; }
+    .uid-spacer { visibility:hidden; }
     .uid-item {
       padding: 10px 12px;
       border-radius: 14px;
@@ -566,21 +548,24 @@ def build_index_html(last_fw, last_uid, last_access, last_name, cards):
     <div class="card">
       <div class="kv">
         <div class="k">Firmware</div>
-        <div class="v"><code id="fw">__FW__</code></div>
+        <div class="v"><code id="fw"><!--$fw-->—<!--/--></code></div>
 
         <div class="k">Last UID</div>
-        <div class="v"><code id="uid">__UID__</code></div>
+        <div class="v"><code id="uid"><!--$uid-->—<!--/--></code></div>
 
         <div class="k">Name</div>
-        <div class="v"><code id="name">__NAME__</code></div>
+        <div class="v"><code id="name"><!--$name-->—<!--/--></code></div>
 
         <div class="k">Access</div>
         <div class="v">
-          <span id="accPill" class="pill __ACC_CLASS__"><span class="dot"></span><span id="accTxt">__ACC__</span></span>
+          <!--$acc--><span id="accPill" class="pill pill-neutral"><span class="dot"></span><span id="accTxt">—</span></span><!--/-->
         </div>
 
         <div class="k">Time</div>
         <div class="v"><code id="ts">—</code></div>
+
+        <div class="k">On reader</div>
+        <div class="v"><code id="present">—</code></div>
       </div>
     </div>
 
@@ -605,7 +590,13 @@ def build_index_html(last_fw, last_uid, last_access, last_name, cards):
         </div>
       </div>
 
-      <ul id="uids" class="uids">__UIDS__</ul>
+      <div style="height:10px;"></div>
+      <input id="search_in" placeholder="Search: UID or name prefix" autocomplete="off" oninput="onSearch()"/>
+
+      <ul id="uids" class="uids"><!--$uids--><!--/--></ul>
+      <div class="rowBtns" style="margin-top:8px; align-items:center;">
+        <span id="listInfo" class="themeLabel"></span>
+      </div>
     </div>
 
   </div>
@@ -639,7 +630,8 @@ def build_index_html(last_fw, last_uid, last_access, last_name, cards):
 <script>
   function api(path, data){
     const token = (document.getElementById('token_in')?.value || '').trim();
-    const headers = {"Content-Type":"application/json"};
+    // mutations answer {ok, msg, version} only; the list follows via SSE deltas
+    const headers = {"Content-Type":"application/json", "Prefer":"return=minimal"};
     if(token) headers["X-Admin-Token"] = token;
     
     const body = data || {};
@@ -678,42 +670,183 @@ def build_index_html(last_fw, last_uid, last_access, last_name, cards):
     return s.replaceAll('&','&amp;').replaceAll('<','&lt;').replaceAll('>','&gt;').replaceAll('"','&quot;').replaceAll("'",'&#39;');
   }
 
+  // Card list: virtualized. Only the rows in view (plus OVERSCAN) are in the
+  // DOM; cursor pages from /api/uids/list are fetched as the user scrolls,
+  // and SSE "cards" deltas patch the loaded rows by UID.
+  const PAGE = 50;
+  const ROW_H = 60;      // .uid-item height + gap
+  const OVERSCAN = 6;
+  let rows = [];         // loaded cards, sorted by uid
+  let listNext = null;   // cursor of the next page (null = all loaded)
+  let listTotal = 0;
+  let dbVersion = null;
+  let listGen = 0;       // bumped on reload, late pages of an old list are dropped
+  let loading = false;
+  let drawPending = false;
+  let searchTimer = null;
+
+  function listQuery(){
+    return (document.getElementById('search_in')?.value || '').trim();
+  }
+
   function refreshList(){
-    api('/api/uids/list',{}).then(r=>{
+    listGen++;
+    loading = false;
+    loadPage('');
+  }
+
+  function loadPage(after){
+    const gen = listGen;
+    loading = true;
+    api('/api/uids/list', {after: after, limit: PAGE, q: listQuery()}).then(r=>{
+      if(gen !== listGen) return;
+      loading = false;
+      if(r.ok) applyPage(r, !!after);
+    }).catch(_=>{ if(gen === listGen) loading = false; });
+  }
+
+  function applyPage(r, append){
+    const cards = r.cards || [];
+    rows = append ? rows.concat(cards) : cards.slice();
+    listNext = r.next || null;
+    listTotal = r.total || 0;
+    if(r.version != null) dbVersion = r.version;
+    drawSoon();
+  }
+
+  function onSearch(){
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(()=>{
       const ul = document.getElementById('uids');
-      if(!ul) return;
-      ul.innerHTML = '';
-      (r.cards||[]).forEach(c=>{
-        const li = document.createElement('li');
-        li.className = 'uid-item';
-
-        const left = document.createElement('span');
-        left.className = 'uid-text';
-        left.textContent = c.uid + (c.name ? (' — ' + c.name) : '');
-
-        const acts = document.createElement('span');
-        acts.className = 'uid-actions';
-
-        const bEdit = document.createElement('button');
-        bEdit.className = 'iconBtn';
-        bEdit.title = 'Edit';
-        bEdit.textContent = '✎';
-        bEdit.onclick = ()=>pickUid(c.uid||'', c.name||'');
-
-        const bDel = document.createElement('button');
-        bDel.className = 'iconBtn danger';
-        bDel.title = 'Delete';
-        bDel.textContent = '✖';
-        bDel.onclick = ()=>delUid(c.uid||'');
-
-        acts.appendChild(bEdit);
-        acts.appendChild(bDel);
-
-        li.appendChild(left);
-        li.appendChild(acts);
-        ul.appendChild(li);
-      });
-    }).catch(_=>{});
+      if(ul) ul.scrollTop = 0;
+      refreshList();
+    }, 250);
+  }
+
+  // Scroll height: the whole DB when unfiltered, otherwise what is loaded
+  // plus one page while more may follow.
+  function rowCount(){
+    if(!listQuery()) return Math.max(rows.length, listNext ? listTotal : rows.length);
+    return rows.length + (listNext ? PAGE : 0);
+  }
+
+  function drawSoon(){
+    if(drawPending) return;
+    drawPending = true;
+    requestAnimationFrame(()=>{ drawPending = false; drawList(); });
+  }
+
+  function drawList(){
+    const ul = document.getElementById('uids');
+    if(!ul) return;
+    if(!ul.classList.contains('virt')){
+      ul.innerHTML = '<li class="uid-spacer"></li>';
+      ul.classList.add('virt');
+      ul.addEventListener('scroll', drawSoon, {passive: true});
+    }
+    const spacer = ul.firstChild;
+    const n = rowCount();
+    spacer.style.height = (n * ROW_H) + 'px';
+    while(spacer.nextSibling) ul.removeChild(spacer.nextSibling);
+
+    const first = Math.max(0, Math.floor(ul.scrollTop / ROW_H) - OVERSCAN);
+    const last = Math.min(n, Math.ceil((ul.scrollTop + ul.clientHeight) / ROW_H) + OVERSCAN);
+    const frag = document.createDocumentFragment();
+    for(let i = first; i < last; i++){
+      frag.appendChild(i < rows.length ? cardRow(rows[i], i) : loadingRow(i));
+    }
+    ul.appendChild(frag);
+
+    if(last > rows.length && listNext && !loading) loadPage(listNext);
+
+    const info = document.getElementById('listInfo');
+    if(info){
+      info.textContent = listQuery()
+        ? (rows.length + (listNext ? '+' : '') + ' found / ' + listTotal + ' total')
+        : (listTotal + ' cards');
+    }
+  }
+
+  function loadingRow(i){
+    const li = document.createElement('li');
+    li.className = 'uid-item';
+    li.style.top = (i * ROW_H) + 'px';
+    li.textContent = '…';
+    return li;
+  }
+
+  function cardRow(c, i){
+    const li = document.createElement('li');
+    li.className = 'uid-item';
+    li.style.top = (i * ROW_H) + 'px';
+
+    const left = document.createElement('span');
+    left.className = 'uid-text';
+    left.textContent = c.uid + (c.name ? (' — ' + c.name) : '');
+
+    const acts = document.createElement('span');
+    acts.className = 'uid-actions';
+
+    const bEdit = document.createElement('button');
+    bEdit.className = 'iconBtn';
+    bEdit.title = 'Edit';
+    bEdit.textContent = '✎';
+    bEdit.onclick = ()=>pickUid(c.uid||'', c.name||'');
+
+    const bDel = document.createElement('button');
+    bDel.className = 'iconBtn danger';
+    bDel.title = 'Delete';
+    bDel.textContent = '✖';
+    bDel.onclick = ()=>delUid(c.uid||'');
+
+    acts.appendChild(bEdit);
+    acts.appendChild(bDel);
+
+    li.appendChild(left);
+    li.appendChild(acts);
+    return li;
+  }
+
+  // Index of uid in rows, or where it would be inserted
+  function rowIndex(uid){
+    let lo = 0, hi = rows.length;
+    while(lo < hi){
+      const mid = (lo + hi) >> 1;
+      if(rows[mid].uid < uid) lo = mid + 1; else hi = mid;
+    }
+    return lo;
+  }
+
+  // SSE "cards": {version, base, ops:[{op, uid, name}]} or {version, base, reset}
+  function applyDelta(d){
+    if(dbVersion === null) return;  // first page not loaded yet
+    if(d.reset || d.base !== dbVersion || listQuery()){
+      refreshList();
+      return;
+    }
+    (d.ops || []).forEach(o=>{
+      const i = rowIndex(o.uid);
+      const hit = i < rows.length && rows[i].uid === o.uid;
+      if(o.op === 'remove'){
+        if(hit) rows.splice(i, 1);
+        listTotal = Math.max(0, listTotal - 1);
+      } else if(hit){
+        rows[i] = {uid: o.uid, name: o.name || ''};
+      } else if(o.op === 'add'){
+        // beyond the loaded range it arrives with a later page
+        if(i < rows.length || !listNext) rows.splice(i, 0, {uid: o.uid, name: o.name || ''});
+        listTotal++;
+      }
+    });
+    dbVersion = d.version;
+    drawSoon();
+  }
+
+  // After our own change: the SSE delta normally arrives first; reload only
+  // if it did not (no live /events connection).
+  function afterChange(r){
+    if(r.version == null) return;
+    setTimeout(()=>{ if(dbVersion !== null && dbVersion < r.version) refreshList(); }, 1500);
   }
 
   function addUid(){
@@ -722,7 +855,7 @@ def build_index_html(last_fw, last_uid, last_access, last_name, cards):
     api('/api/uids/add', {uid_hex: uid, name: name}).then(r=>{
       document.getElementById('uid_in').value='';
       document.getElementById('name_in').value='';
-      refreshList();
+      afterChange(r);
       toast(r.ok ? 'OK' : 'ERR', r.msg || 'Add', r.ok ? 'good' : 'bad');
     }).catch(_=>{ toast('ERR','API error','bad'); });
   }
@@ -731,14 +864,14 @@ def build_index_html(last_fw, last_uid, last_access, last_name, cards):
     const uid = (document.getElementById('uid_in').value||'');
     api('/api/uids/remove', {uid_hex: uid}).then(r=>{
       document.getElementById('uid_in').value='';
-      refreshList();
+      afterChange(r);
       toast(r.ok ? 'OK' : 'ERR', r.msg || 'Remove', r.ok ? 'good' : 'bad');
     }).catch(_=>{ toast('ERR','API error','bad'); });
   }
 
   function addLastUid(){
     api('/api/uids/add_last', {}).then(r=>{
-      refreshList();
+      afterChange(r);
       toast(r.ok ? 'OK' : 'ERR', r.msg || 'Add last', r.ok ? 'good' : 'bad');
     }).catch(_=>{ toast('ERR','API error','bad'); });
   }
@@ -747,14 +880,14 @@ def build_index_html(last_fw, last_uid, last_access, last_name, cards):
     const uid = (document.getElementById('uid_in').value||'');
     const name = (document.getElementById('name_in').value||'');
     api('/api/uids/set_name', {uid_hex: uid, name: name}).then(r=>{
-      refreshList();
+      afterChange(r);
       toast(r.ok ? 'OK' : 'ERR', r.msg || 'Set name', r.ok ? 'good' : 'bad');
     }).catch(_=>{ toast('ERR','API error','bad'); });
   }
 
   function clrUid(){
     api('/api/uids/clear', {}).then(r=>{
-      refreshList();
+      afterChange(r);
       toast(r.ok ? 'OK' : 'ERR', r.msg || 'Clear', r.ok ? 'good' : 'bad');
     }).catch(_=>{ toast('ERR','API error','bad'); });
   }
@@ -771,7 +904,7 @@ def build_index_html(last_fw, last_uid, last_access, last_name, cards):
   function delUid(uid){
     if(!uid) return;
     api('/api/uids/remove', {uid_hex: uid}).then(r=>{
-      refreshList();
+      afterChange(r);
       toast(r.ok ? 'OK' : 'ERR', r.msg || 'Delete', r.ok ? 'good' : 'bad');
     }).catch(_=>{ toast('ERR','API error','bad'); });
   }
@@ -901,21 +1034,41 @@ def build_index_html(last_fw, last_uid, last_access, last_name, cards):
     if(d.uid){
       addHistoryRow({ ts: ts, uid: d.uid, name: (d.name||''), access: (d.access||'') });
     }
+
+    // A version we have no delta for (missed while reconnecting, or the
+    // device rebooted and its counter restarted): reload
+    if(d.version != null && dbVersion !== null && d.version !== dbVersion){
+      refreshList();
+    }
   });
+  es.addEventListener('cards', (e)=>{ applyDelta(JSON.parse(e.data)); });
+  es.addEventListener('presence', (e)=>{
+    const d = JSON.parse(e.data);
+    document.getElementById('present').innerText = d.present ? (d.uid || 'yes') : 'no';
+  });
+
+  // Initial state (the page itself is static and cached)
+  function boot(){
+    fetch('/api/bootstrap').then(r=>{
+      if(r.status === 401){ window.location.href = '/login'; return null; }
+      return r.json();
+    }).then(d=>{
+      if(!d || !d.ok) return;
+      document.getElementById('fw').innerText = (d.fw==null?'':d.fw);
+      document.getElementById('uid').innerText = d.uid || '';
+      document.getElementById('name').innerText = d.name || '';
+      setAccessPill(d.access || '');
+      if(listQuery()) refreshList();
+      else applyPage(d, false);
+    }).catch(_=>{});
+  }
+  boot();
 
 </script>
 
 </body>
 </html>
-"""
-
-    html = html.replace("__FW__", html_escape(last_fw))
-    html = html.replace("__UID__", html_escape(last_uid))
-    html = html.replace("__ACC__", html_escape(last_access))
-    html = html.replace("__NAME__", html_escape(last_name))
-    html = html.replace("__UIDS__", uids_li)
-    html = html.replace("__ACC_CLASS__", acc_class)
-    return html
+""".encode()
 
 
 # --- helper: safe JS string literal (no extra imports, minimal) ---
@@ -925,4 +1078,172 @@ def ujson_safe(s):
     s = str(s if s is not None else "")
     s = s.replace("\\", "\\\\").replace('"', '\\"')
     s = s.replace("\n", "\\n").replace("\r", "\\r")
-    return '"' + s + '"'
\ No newline at end of file
+    return '"' + s + '"'
+
+
+# -----------------------
+# Static assets: bytes + gzip + ETag, built once
+# -----------------------
+_PAGES = {"index": _INDEX_HTML, "login": _LOGIN_HTML}
+_ASSETS = {}  # name -> (raw_bytes, gzip_bytes or None, etag)
+
+
+def page_etag(raw):
+    """Strong ETag of a page body: first 16 hex chars of its SHA-256."""
+    try:
+        import uhashlib as hashlib
+    except ImportError:
+        import hashlib
+    try:
+        import ubinascii as binascii
+    except ImportError:
+        import binascii
+    return binascii.hexlify(hashlib.sha256(raw).digest()).decode()[:16]
+
+
+def gz_file_name(name, etag):
+    """Precompressed copy on flash, written by tools/build_ui_gz.py."""
+    return "ui_{}_{}.gz".format(name, etag)
+
+
+def _gzip(raw):
+    # MicroPython >= 1.21 (if built with compression support). The third
+    # argument is the window (wbits), there is no level: the full 32 KB
+    # window covers the whole page, 4 KB is the fallback when RAM is short.
+    try:
+        import deflate
+        import io
+        for wbits in (15, 12):
+            try:
+                buf = io.BytesIO()
+                f = deflate.DeflateIO(buf, deflate.GZIP, wbits)
+                f.write(raw)
+                f.close()
+                return buf.getvalue()
+            except MemoryError:
+                pass
+    except Exception:
+        pass
+    # CPython (tools)
+    try:
+        import gzip
+        return gzip.compress(raw, 9, mtime=0)
+    except Exception:
+        return None
+
+
+def asset(name):
+    """
+    ("index" | "login") -> (raw_bytes, gzip_bytes or None, etag).
+    The gzip copy is read from flash if tools/build_ui_gz.py uploaded one that
+    matches this firmware's page, otherwise compressed on the device (once).
+    """
+    a = _ASSETS.get(name)
+    if a is not None:
+        return a
+
+    raw = _PAGES[name]
+    etag = page_etag(raw)
+    gz = None
+    try:
+        with open(gz_file_name(name, etag), "rb") as f:
+            gz = f.read()
+    except OSError:
+        gz = _gzip(raw)
+
+    a = (raw, gz, etag)
+    _ASSETS[name] = a
+    return a
+
+
+# -----------------------
+# Streaming renderer (server-side rendered dashboard)
+# -----------------------
+_TEMPLATES = {}  # name -> [memoryview | slot name, ...]
+
+
+def compile_template(raw):
+    """
+    Split page bytes at <!--$slot-->...<!--/--> markers.
+    Returns a list of static memoryview segments (no copies) and slot names (str).
+    """
+    mv = memoryview(raw)
+    out = []
+    pos = 0
+    while True:
+        a = raw.find(b"<!--$", pos)
+        if a < 0:
+            break
+        b = raw.find(b"-->", a)
+        end = raw.find(b"<!--/-->", b)
+        if b < 0 or end < 0:
+            break
+        if a > pos:
+            out.append(mv[pos:a])
+        out.append(bytes(mv[a + 5:b]).decode())
+        pos = end + 8
+    if pos < len(raw):
+        out.append(mv[pos:])
+    return out
+
+
+def template(name):
+    t = _TEMPLATES.get(name)
+    if t is None:
+        t = compile_template(_PAGES[name])
+        _TEMPLATES[name] = t
+    return t
+
+
+def render(tpl, ctx):
+    """
+    Generator of byte chunks. Slot values: str (HTML-escaped here),
+    bytes (sent as-is) or any iterable of bytes (e.g. a row generator).
+    Missing slots render empty.
+    """
+    for seg in tpl:
+        if not isinstance(seg, str):
+            yield seg
+            continue
+        v = ctx.get(seg)
+        if v is None:
+            continue
+        if isinstance(v, str):
+            yield html_escape(v).encode()
+        elif isinstance(v, (bytes, bytearray, memoryview)):
+            yield v
+        else:
+            for chunk in v:
+                yield chunk
+
+
+def access_pill(access):
+    acc = (access or "").upper()
+    cls = "pill-neutral"
+    if acc == "GRANTED":
+        cls = "pill-good"
+    elif acc == "DENIED":
+        cls = "pill-bad"
+    return '<span id="accPill" class="pill {}"><span class="dot"></span><span id="accTxt">{}</span></span>'.format(
+        cls, html_escape(access)
+    ).encode()
+
+
+def card_rows(cards):
+    """cards: iterable of (uid_hex, name). Yields one <li> at a time."""
+    for uid, name in cards:
+        yield (
+            "<li class='uid-item'>"
+            "<span class='uid-text'>{}</span>"
+            "<span class='uid-actions'>"
+            "<button class='iconBtn' title='Edit' onclick='pickUid({}, {})'>✎</button>"
+            "<button class='iconBtn danger' title='Delete' onclick='delUid({})'>✖</button>"
+            "</span>"
+            "</li>"
+        ).format(
+            html_escape(uid + (" — " + name if name else "")),
+            ujson_safe(html_escape(uid)),
+            ujson_safe(html_escape(name)),
+            ujson_safe(html_escape(uid)),
+        ).encode()
+
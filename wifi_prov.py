@@ -331,7 +331,9 @@ def _read_full_request(cl, max_total=4096):
     return data
 
 
-def provisioning_portal(loop_forever=True):
+def provisioning_portal(loop_forever=True, on_idle=None):
+    # on_idle: called about once a second while no client connects
+    # (the app uses it to keep feeding its watchdog)
     ap, ap_ssid = start_ap()
     print("AP started:", ap_ssid, "pass:", AP_PASS)
     print("Open in phone browser:", "http://" + AP_IP)
@@ -341,9 +343,17 @@ def provisioning_portal(loop_forever=True):
     s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     s.bind(addr)
     s.listen(2)
+    if on_idle:
+        s.settimeout(1.0)
 
     while True:
-        cl, _ = s.accept()
+        try:
+            cl, _ = s.accept()
+        except OSError:
+            if not on_idle:
+                raise
+            on_idle()
+            continue
         try:
             req = _read_full_request(cl)
             if not req: